@@ -0,0 +1,26 @@
+# pytest benchmarks/bench_bronx.py --benchmark-json=report.json
+import pytest
+pytest.importorskip("pytest_benchmark")
+from bronx.benchmarks import TARGETS, get_config, reset_nfe
+
+
+@pytest.mark.parametrize("physique", [0, 1])
+@pytest.mark.parametrize("adjoint", [0, 1])
+@pytest.mark.parametrize("num_particles", [1, 4])
+@pytest.mark.parametrize("num_heads", [1, 4])
+@pytest.mark.parametrize("num_nodes", [1000, 10000])
+@pytest.mark.parametrize("target", list(TARGETS))
+def test_bronx(benchmark, target, num_nodes, num_heads, num_particles, adjoint, physique):
+    config = get_config(
+        num_nodes=num_nodes,
+        num_heads=num_heads,
+        num_particles=num_particles,
+        adjoint=adjoint,
+        physique=physique,
+    )
+    fn, counter = TARGETS[target](config)
+    fn()
+    reset_nfe(counter)
+    benchmark.pedantic(fn, rounds=5, warmup_rounds=0)
+    benchmark.extra_info.update(config)
+    benchmark.extra_info["nfe"] = counter.nfe / 5
@@ -0,0 +1,198 @@
+"""Performance regression gate.
+
+Runs a fixed, seeded set of CPU workloads, i.e. the microbenchmarks of
+:mod:`bronx.benchmarks` on small configurations and a few epochs of the
+node classification script on a synthetic graph, and compares their
+time, NFE and memory with a checked-in baseline::
+
+    python benchmarks/gate.py                 # exits 1 on regression
+    python benchmarks/gate.py --update        # (re)write the baseline
+
+Every workload runs in a fresh process on ``--num_threads`` threads
+(torch and dgl keep separate pools), so that its time does not depend on
+the allocator state left behind by the others. Its median time is divided
+by the median time of a fixed reference matmul measured in the same
+process, so that baselines recorded on another machine, or under a
+different load, stay roughly comparable. Since the workloads are seeded
+(including dgl's generator), NFE and profiled memory are reproducible
+exactly. A workload missing from the baseline fails the gate until it is
+updated.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import torch
+import dgl
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+TOLERANCES = {"time": 0.5, "nfe": 0.05, "memory": 0.1}
+
+# time tolerances of noisier workloads, by name prefix
+TIME_TOLERANCES = {"run-": 1.0}
+
+MICROBENCHMARKS = [
+    ("linear_diffusion", {"num_nodes": 2000, "adjoint": 0}),
+    ("linear_diffusion", {"num_nodes": 2000, "adjoint": 1}),
+    ("layer_guide", {"num_nodes": 2000}),
+    ("svi_step", {"num_nodes": 2000, "adjoint": 0}),
+    ("svi_step", {"num_nodes": 2000, "adjoint": 1}),
+    ("predictive", {"num_nodes": 2000}),
+]
+
+def set_num_threads(num_threads):
+    torch.set_num_threads(num_threads)
+    dgl.utils.set_num_threads(num_threads)
+
+def reference_time(repeat=7):
+    a = torch.randn(512, 512, generator=torch.Generator().manual_seed(0))
+    times = []
+    for _ in range(repeat):
+        time0 = time.perf_counter()
+        for _ in range(10):
+            a @ a
+        times.append(time.perf_counter() - time0)
+    return sorted(times)[len(times) // 2]
+
+def microbenchmark(target, overrides, repeat, num_threads):
+    from bronx.benchmarks import TARGETS, get_config, measure
+    from bronx.profiling import profile_memory
+    from bronx.utils import set_benchmark
+    import pyro
+    set_num_threads(num_threads)
+    set_benchmark(True)
+    reference = reference_time()
+    config = get_config(**overrides)
+    torch.manual_seed(config["seed"])
+    pyro.set_rng_seed(config["seed"])
+    fn, counter = TARGETS[target](config)
+    result = measure(fn, counter, repeat=repeat)
+    _, memory = profile_memory(fn)
+    return {
+        "time": result["time_median"] / reference,
+        "nfe": result["nfe"],
+        "memory": memory["peak"],
+    }
+
+def training(num_nodes, n_epochs):
+    # a few epochs of run.py, read back from its telemetry
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "telemetry.jsonl")
+        subprocess.run(
+            [
+                sys.executable, "run.py",
+                "--data", "Synthetic-%d" % num_nodes,
+                "--n_epochs", str(n_epochs),
+                "--seed", "2666",
+                "--telemetry", path,
+            ],
+            cwd=os.path.join(ROOT, "scripts", "node_classification"),
+            env=dict(
+                os.environ,
+                PYTHONPATH=os.pathsep.join([ROOT, os.environ.get("PYTHONPATH", "")]),
+                OMP_NUM_THREADS=str(torch.get_num_threads()),
+                BRONX_BENCHMARK="1",
+            ),
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        with open(path, "r") as f:
+            records = [json.loads(line) for line in f]
+    records = records[1:] or records  # the first epoch includes warmup
+    return {
+        "time": sorted(record["time_epoch"] for record in records)[len(records) // 2],
+        "nfe": sum(record["nfe_step"] for record in records) / len(records),
+    }
+
+def run(args):
+    set_num_threads(args.num_threads)
+    results = {}
+    for target, overrides in MICROBENCHMARKS:
+        name = target + "".join(
+            "-%s=%s" % (key, value) for key, value in sorted(overrides.items())
+        )
+        context = torch.multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            results[name] = executor.submit(
+                microbenchmark, target, overrides, args.repeat, args.num_threads,
+            ).result()
+    if args.n_epochs > 0:
+        name = "run-Synthetic-%d" % args.num_nodes
+        reference = reference_time()
+        results[name] = training(args.num_nodes, args.n_epochs)
+        results[name]["time"] /= reference
+    return results
+
+def tolerance(name, metric, tolerances):
+    if metric == "time":
+        for prefix, value in TIME_TOLERANCES.items():
+            if name.startswith(prefix):
+                return max(value, tolerances[metric])
+    return tolerances[metric]
+
+def compare(results, baseline, tolerances):
+    """Regressions of ``results`` w.r.t. ``baseline``, as a list of
+    ``(workload, metric, baseline, current)``; a workload without a
+    baseline is a regression with metric ``"baseline"``. Workloads
+    matching :data:`TIME_TOLERANCES` get the larger of the two time
+    tolerances."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print("%s: no baseline" % name, flush=True)
+            regressions.append((name, "baseline", None, None))
+            continue
+        for metric, value in result.items():
+            reference = baseline[name].get(metric)
+            if reference is None or value is None:
+                continue
+            ratio = value / reference if reference > 0 else float(value > 0) + 1.0
+            print("%s %s: %.4g (baseline %.4g, x%.2f)" % (
+                name, metric, value, reference, ratio,
+            ), flush=True)
+            if ratio > 1.0 + tolerance(name, metric, tolerances):
+                regressions.append((name, metric, reference, value))
+    return regressions
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", type=str, default=os.path.join(HERE, "baseline.json"))
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--num_threads", type=int, default=1)
+    parser.add_argument("--num_nodes", type=int, default=2000)
+    parser.add_argument("--n_epochs", type=int, default=5)
+    parser.add_argument("--time_tolerance", type=float, default=TOLERANCES["time"])
+    parser.add_argument("--nfe_tolerance", type=float, default=TOLERANCES["nfe"])
+    parser.add_argument("--memory_tolerance", type=float, default=TOLERANCES["memory"])
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump({"workloads": results}, f, indent=2, sort_keys=True)
+        sys.exit(0)
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)["workloads"]
+    regressions = compare(
+        results, baseline,
+        {
+            "time": args.time_tolerance,
+            "nfe": args.nfe_tolerance,
+            "memory": args.memory_tolerance,
+        },
+    )
+    for name, metric, reference, value in regressions:
+        if reference is None:
+            print("REGRESSION %s: no baseline, run with --update" % name, flush=True)
+        else:
+            print("REGRESSION %s %s: %.4g -> %.4g" % (name, metric, reference, value), flush=True)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,246 @@
+"""Microbenchmarks of the diffusion, the layers and a full training step.
+
+Run ``python -m bronx.benchmarks --output report.json`` for a sweep over
+the grid given on the command line, or time the same workloads with
+pytest-benchmark through ``benchmarks/bench_bronx.py``.
+"""
+import time
+import json
+import types
+import itertools
+import platform
+import torch
+import pyro
+import dgl
+from .layers import LinearDiffusion, BronxLayer
+from .models import NodeClassificationBronxModel
+from .infer import get_elbo
+from .distributions import LogitNormal
+from .utils import prepare_graph
+
+DEFAULTS = {
+    "num_nodes": 1000,
+    "avg_degree": 10,
+    "num_heads": 4,
+    "hidden_features": 32,
+    "num_particles": 4,
+    "adjoint": 0,
+    "physique": 0,
+    "t": 1.0,
+    "distribution": "logit_normal",
+    "multilevel": 0,
+    "fine_fraction": 0.1,
+    "seed": 2666,
+}
+
+def get_config(**kwargs):
+    config = dict(DEFAULTS)
+    config.update(kwargs)
+    return config
+
+def get_graph(config):
+    # dgl.rand_graph draws from dgl's own generator
+    torch.manual_seed(config["seed"])
+    dgl.seed(config["seed"])
+    num_nodes = config["num_nodes"]
+    g = prepare_graph(dgl.rand_graph(num_nodes, num_nodes * config["avg_degree"]))
+    h = torch.randn(num_nodes, config["hidden_features"])
+    return g, h
+
+def linear_diffusion(config):
+    g, h = get_graph(config)
+    e = torch.rand(
+        config["num_particles"], g.number_of_edges(), config["num_heads"], 1,
+    )
+    diffusion = LinearDiffusion(
+        config["t"], adjoint=bool(config["adjoint"]), physique=bool(config["physique"]),
+        levels=config["multilevel"], fine_fraction=config["fine_fraction"],
+    )
+    fn = lambda: diffusion(g, h, e)
+    if config["multilevel"] > 0:
+        # relative error w.r.t. the fine-level solve, reported by sweep
+        fn.error = lambda: diffusion.multilevel_error(g, h, e)
+    return fn, diffusion.odefunc
+
+def _layer(config):
+    g, h = get_graph(config)
+    layer = BronxLayer(
+        config["hidden_features"],
+        config["hidden_features"],
+        num_heads=config["num_heads"],
+        t=config["t"],
+        adjoint=bool(config["adjoint"]),
+        physique=bool(config["physique"]),
+    )
+    return g, h, layer
+
+def layer_guide(config):
+    g, h, layer = _layer(config)
+    def fn():
+        with pyro.plate("particles", config["num_particles"], dim=-2):
+            return layer.guide(g, h)
+    return fn, layer.linear_diffusion.odefunc
+
+def layer_forward(config):
+    g, h, layer = _layer(config)
+    def fn():
+        with pyro.plate("particles", config["num_particles"], dim=-2):
+            return layer(g, h)
+    return fn, layer.linear_diffusion.odefunc
+
+def _model(config):
+    g, h = get_graph(config)
+    y = torch.randint(4, (g.number_of_nodes(),))
+    model = NodeClassificationBronxModel(
+        in_features=config["hidden_features"],
+        hidden_features=config["hidden_features"],
+        out_features=4,
+        num_heads=config["num_heads"],
+        t=config["t"],
+        adjoint=bool(config["adjoint"]),
+        physique=bool(config["physique"]),
+    )
+    return g, h, y, model
+
+def svi_step(config):
+    pyro.clear_param_store()
+    g, h, y, model = _model(config)
+    svi = pyro.infer.SVI(
+        model, model.guide, pyro.optim.Adam({"lr": 1e-3}),
+        loss=get_elbo(config["num_particles"]),
+    )
+    fn = lambda: svi.step(g, h, y=y)
+    return fn, model
+
+def predictive(config):
+    pyro.clear_param_store()
+    g, h, y, model = _model(config)
+    model.eval()
+    predictive = pyro.infer.Predictive(
+        model,
+        guide=model.guide,
+        num_samples=config["num_particles"],
+        parallel=True,
+        return_sites=["_RETURN"],
+    )
+    def fn():
+        with torch.no_grad():
+            return predictive(g, h)
+    return fn, model
+
+def edge_distribution(config):
+    # sample, score and backpropagate through the edge weights of a layer;
+    # compare with --targets edge_distribution --distribution
+    # logit_normal,transformed --num_nodes 1000000 --avg_degree 10 (E = 10^7)
+    torch.manual_seed(config["seed"])
+    shape = (config["num_nodes"] * config["avg_degree"], config["num_heads"], 1)
+    loc = torch.randn(shape, requires_grad=True)
+    log_scale = torch.randn(shape, requires_grad=True)
+    def fn():
+        if config["distribution"] == "logit_normal":
+            distribution = LogitNormal(loc, log_scale.exp())
+        else:
+            distribution = pyro.distributions.TransformedDistribution(
+                pyro.distributions.Normal(loc, log_scale.exp()),
+                pyro.distributions.transforms.SigmoidTransform(),
+            )
+        distribution = distribution.to_event(2)
+        e = distribution.rsample()
+        distribution.log_prob(e).backward()
+    return fn, types.SimpleNamespace(nfe=0)
+
+TARGETS = {
+    "linear_diffusion": linear_diffusion,
+    "layer_guide": layer_guide,
+    "layer_forward": layer_forward,
+    "svi_step": svi_step,
+    "predictive": predictive,
+    "edge_distribution": edge_distribution,
+}
+
+def reset_nfe(counter):
+    if hasattr(counter, "reset_nfe"):
+        counter.reset_nfe()
+    else:
+        counter.nfe = 0
+
+def measure(fn, counter, repeat=5, warmup=1):
+    """Wall time (seconds) and number of function evaluations per call."""
+    for _ in range(warmup):
+        fn()
+    reset_nfe(counter)
+    times = []
+    for _ in range(repeat):
+        time0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - time0)
+    times = torch.tensor(times)
+    return {
+        "time_mean": float(times.mean()),
+        "time_min": float(times.min()),
+        "time_median": float(times.median()),
+        "time_std": float(times.std()) if repeat > 1 else 0.0,
+        "nfe": counter.nfe / repeat,
+    }
+
+def sweep(targets, grid, repeat=5, warmup=1):
+    """Time every target on every configuration in the product of
+    ``grid`` (a dict of lists overriding :data:`DEFAULTS`)."""
+    keys = list(grid.keys())
+    results = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        config = get_config(**dict(zip(keys, values)))
+        for target in targets:
+            fn, counter = TARGETS[target](config)
+            result = {"target": target, **config}
+            result.update(measure(fn, counter, repeat=repeat, warmup=warmup))
+            if hasattr(fn, "error"):
+                result["error"] = fn.error()
+            print(json.dumps(result), flush=True)
+            results.append(result)
+    return results
+
+def environment():
+    return {
+        "torch": torch.__version__,
+        "dgl": dgl.__version__,
+        "pyro": pyro.__version__,
+        "num_threads": torch.get_num_threads(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", type=str, default=",".join(TARGETS))
+    parser.add_argument("--num_nodes", type=str, default="1000,10000")
+    parser.add_argument("--avg_degree", type=str, default="10")
+    parser.add_argument("--num_heads", type=str, default="4")
+    parser.add_argument("--hidden_features", type=str, default="32")
+    parser.add_argument("--num_particles", type=str, default="4")
+    parser.add_argument("--adjoint", type=str, default="0,1")
+    parser.add_argument("--physique", type=str, default="0,1")
+    parser.add_argument("--distribution", type=str, default="logit_normal")
+    parser.add_argument("--multilevel", type=str, default="0")
+    parser.add_argument("--fine_fraction", type=str, default="0.1")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+
+    grid = {
+        key: [int(value) for value in getattr(args, key).split(",")]
+        for key in [
+            "num_nodes", "avg_degree", "num_heads", "hidden_features",
+            "num_particles", "adjoint", "physique", "multilevel",
+        ]
+    }
+    grid["fine_fraction"] = [float(value) for value in args.fine_fraction.split(",")]
+    grid["distribution"] = args.distribution.split(",")
+    results = sweep(
+        args.targets.split(","), grid, repeat=args.repeat, warmup=args.warmup,
+    )
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import torch
+import dgl
+
+_HIERARCHY_CACHE = OrderedDict()
+_HIERARCHY_CACHE_SIZE = 8
+
+def heavy_edge_matching(src, dst, num_nodes, rounds=4, generator=None):
+    """Handshake heavy-edge matching of an (undirected) graph.
+
+    Every unmatched node proposes to its unmatched neighbor with the
+    heaviest edge, ``1 / deg(u) + 1 / deg(v)`` with random tie breaks, and
+    mutual proposals are matched; repeated for ``rounds`` rounds.
+
+    Returns
+    -------
+    torch.Tensor
+        The cluster (0, ..., num_clusters - 1) of every node.
+    """
+    src, dst = src.long(), dst.long()
+    src, dst = torch.cat([src, dst]), torch.cat([dst, src])
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    degree = torch.bincount(src, minlength=num_nodes).clamp(min=1).float()
+    weight = 1.0 / degree[src] + 1.0 / degree[dst]
+    weight = weight + 1e-6 * torch.rand(
+        weight.shape, generator=generator, device=weight.device,
+    )
+
+    match = torch.full((num_nodes,), -1, dtype=torch.long, device=src.device)
+    for _ in range(rounds):
+        free = (match[src] < 0) & (match[dst] < 0)
+        if not free.any():
+            break
+        _src, _dst, _weight = src[free], dst[free], weight[free]
+        best = torch.full(
+            (num_nodes,), -1.0, device=weight.device,
+        ).scatter_reduce(0, _src, _weight, reduce="amax")
+        heaviest = _weight == best[_src]
+        proposal = torch.full_like(match, -1)
+        proposal[_src[heaviest]] = _dst[heaviest]
+        idxs = torch.where(proposal >= 0)[0]
+        mutual = idxs[proposal[proposal[idxs]] == idxs]
+        match[mutual] = proposal[mutual]
+
+    idxs = torch.arange(num_nodes, device=src.device)
+    cluster = torch.where(match >= 0, torch.minimum(idxs, match), idxs)
+    return torch.unique(cluster, return_inverse=True)[1]
+
+class Level(object):
+    """One coarsening step: the cluster ``assign``-ment of the fine nodes,
+    the cluster ``size``-s, the coarse edge of every fine edge
+    (``edge_map``), and the coarse graph ``g``."""
+    def __init__(self, assign, size, edge_map, g):
+        self.assign = assign
+        self.size = size
+        self.edge_map = edge_map
+        self.g = g
+        self.dst = g.edges()[1].long()
+
+    def restrict_nodes(self, h):
+        # cluster means of node features with the node dimension first
+        h = h.new_zeros(self.size.shape[0], *h.shape[1:]).index_add_(0, self.assign, h)
+        return h / self.size.view(-1, *((1,) * (h.dim() - 1)))
+
+    def restrict_edges(self, e):
+        # in-normalized fine weights to in-normalized coarse weights
+        e = e.new_zeros(self.g.number_of_edges(), *e.shape[1:]).index_add_(0, self.edge_map, e)
+        return e / self.size[self.dst].view(-1, *((1,) * (e.dim() - 1)))
+
+    def prolong(self, h):
+        return h[self.assign]
+
+def coarsen(g, rounds=4):
+    src, dst = g.edges()
+    assign = heavy_edge_matching(src, dst, g.number_of_nodes(), rounds=rounds)
+    num_clusters = int(assign.max()) + 1 if len(assign) else 0
+    size = torch.bincount(assign, minlength=num_clusters).float()
+    key = assign[src.long()] * num_clusters + assign[dst.long()]
+    key, edge_map = torch.unique(key, return_inverse=True)
+    g_coarse = dgl.graph(
+        (key // num_clusters, key % num_clusters),
+        num_nodes=num_clusters, idtype=g.idtype, device=g.device,
+    )
+    return Level(assign, size, edge_map, g_coarse)
+
+def coarsen_hierarchy(g, levels, min_ratio=0.9):
+    """Up to ``levels`` heavy-edge-matching coarsenings of ``g``, stopping
+    once a level keeps more than ``min_ratio`` of the nodes. Cached per
+    graph structure."""
+    key = (id(g._graph), levels)
+    cached = _HIERARCHY_CACHE.get(key)
+    if cached is not None and cached[0] is g._graph:
+        _HIERARCHY_CACHE.move_to_end(key)
+        return cached[1]
+
+    hierarchy = []
+    g_level = g
+    for _ in range(levels):
+        level = coarsen(g_level)
+        if level.g.number_of_nodes() > min_ratio * g_level.number_of_nodes():
+            break
+        hierarchy.append(level)
+        g_level = level.g
+
+    _HIERARCHY_CACHE[key] = (g._graph, hierarchy)
+    while len(_HIERARCHY_CACHE) > _HIERARCHY_CACHE_SIZE:
+        _HIERARCHY_CACHE.popitem(last=False)
+    return hierarchy
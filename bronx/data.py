@@ -0,0 +1,144 @@
+import torch
+
+def graph_keys(graphs, by="nodes"):
+    """Per-graph bucketing keys from size / degree statistics.
+
+    Parameters
+    ----------
+    graphs : iterable of DGLGraph
+    by : str
+        ``"nodes"``, ``"edges"`` or ``"degree"`` (maximum in-degree,
+        ties broken by number of nodes).
+    """
+    if by not in ("nodes", "edges", "degree"):
+        raise ValueError("Unknown bucketing key %r." % by)
+    keys = []
+    for g in graphs:
+        if by == "nodes":
+            key = g.number_of_nodes()
+        elif by == "edges":
+            key = g.number_of_edges()
+        else:
+            degree = int(g.in_degrees().max()) if g.number_of_edges() else 0
+            key = degree * (1 << 20) + g.number_of_nodes()
+        keys.append(key)
+    # integer keys, the "degree" ones exceed the integers exact in float32
+    return torch.tensor(keys, dtype=torch.long)
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """Batch sampler that groups items with similar keys.
+
+    Items are sorted by key (ties broken at random), cut into batches of
+    ``batch_size`` and the order of the batches is shuffled every epoch,
+    so each batched graph integrated by the ODE solver holds graphs of
+    similar size / stiffness.
+
+    Parameters
+    ----------
+    keys : torch.Tensor
+        One key per item in the dataset.
+    batch_size : int
+    shuffle : bool
+        Whether to shuffle the order of the batches.
+    drop_last : bool
+        Whether to drop the last incomplete batch.
+    """
+    def __init__(self, keys, batch_size, shuffle=True, drop_last=False):
+        self.keys = torch.as_tensor(keys)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.batches = []
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.keys) // self.batch_size
+        return (len(self.keys) + self.batch_size - 1) // self.batch_size
+
+    def _batches(self):
+        keys = self.get_keys()
+        idxs = torch.randperm(len(keys))
+        idxs = idxs[torch.sort(keys[idxs], stable=True)[1]]
+        batches = list(torch.split(idxs, self.batch_size))
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        if self.shuffle:
+            batches = [batches[idx] for idx in torch.randperm(len(batches))]
+        return [batch.tolist() for batch in batches]
+
+    def get_keys(self):
+        return self.keys
+
+    def __iter__(self):
+        self.batches = self._batches()
+        return iter(self.batches)
+
+class NFEBatchSampler(BucketBatchSampler):
+    """Bucket batch sampler keyed by the number of function evaluations
+    previously observed for each item.
+
+    After every step, call :meth:`record` with the index of the batch in
+    the current epoch and the NFE the solver spent on it. Items never
+    seen fall back to the static ``keys``, rescaled to the NFE range.
+
+    Parameters
+    ----------
+    keys : torch.Tensor
+        Static fallback keys, e.g. from :func:`graph_keys`.
+    momentum : float
+        Exponential moving average factor for the recorded NFE.
+    """
+    def __init__(self, keys, batch_size, shuffle=True, drop_last=False, momentum=0.5):
+        super().__init__(keys, batch_size, shuffle=shuffle, drop_last=drop_last)
+        self.momentum = momentum
+        self.nfe = torch.full(self.keys.shape, float("nan"), dtype=torch.double)
+
+    def record(self, batch_idx, nfe):
+        idxs = torch.tensor(self.batches[batch_idx])
+        previous = self.nfe[idxs]
+        self.nfe[idxs] = torch.where(
+            torch.isnan(previous),
+            torch.full_like(previous, float(nfe)),
+            self.momentum * previous + (1 - self.momentum) * nfe,
+        )
+
+    def get_keys(self):
+        seen = ~torch.isnan(self.nfe)
+        if not seen.any():
+            return self.keys
+        keys = self.nfe.clone()
+        if not seen.all():
+            static = self.keys.double()
+            lo, hi = static.min(), static.max()
+            fallback = (static - lo) / (hi - lo).clamp(min=1e-8)
+            nfe_lo, nfe_hi = self.nfe[seen].min(), self.nfe[seen].max()
+            keys[~seen] = nfe_lo + fallback[~seen] * (nfe_hi - nfe_lo)
+        return keys
+
+class ShardedBatchSampler(torch.utils.data.Sampler):
+    """Shard of the batches drawn by ``batch_sampler`` for one of
+    ``world_size`` data-parallel workers.
+
+    All workers draw the same batch order from a generator seeded with
+    ``seed`` and the epoch, leaving the global random state untouched,
+    and keep every ``world_size``-th batch, truncated so that every worker
+    takes the same number of steps.
+    """
+    def __init__(self, batch_sampler, rank, world_size, seed=0):
+        self.batch_sampler = batch_sampler
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self.batch_sampler) // self.world_size
+
+    def __iter__(self):
+        state = torch.get_rng_state()
+        torch.manual_seed(self.seed + self.epoch)
+        batches = list(self.batch_sampler)
+        torch.set_rng_state(state)
+        self.epoch += 1
+        batches = batches[:len(batches) // self.world_size * self.world_size]
+        return iter(batches[self.rank::self.world_size])
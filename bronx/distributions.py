@@ -0,0 +1,70 @@
+import math
+import torch
+from torch.distributions import constraints
+from torch.distributions.kl import register_kl, kl_divergence
+from torch.distributions.utils import broadcast_all
+from pyro.distributions import TorchDistribution, Normal
+
+class LogitNormal(TorchDistribution):
+    """Distribution of ``sigmoid(x)`` with ``x ~ Normal(loc, scale)``.
+
+    Equivalent to ``TransformedDistribution(Normal(loc, scale),
+    SigmoidTransform())`` but samples with one fused ``addcmul`` and
+    sigmoid and evaluates the log density in closed form, without the
+    transform machinery. The logit of the last sample is cached, so
+    scoring it (as the guide does) neither recomputes nor loses precision
+    to the saturated sigmoid.
+    """
+    arg_constraints = {"loc": constraints.real, "scale": constraints.positive}
+    support = constraints.unit_interval
+    has_rsample = True
+
+    def __init__(self, loc, scale, validate_args=None):
+        self.loc, self.scale = broadcast_all(loc, scale)
+        self._cached = None
+        super().__init__(self.loc.shape, validate_args=validate_args)
+
+    def expand(self, batch_shape, _instance=None):
+        new = self._get_checked_instance(LogitNormal, _instance)
+        batch_shape = torch.Size(batch_shape)
+        new.loc = self.loc.expand(batch_shape)
+        new.scale = self.scale.expand(batch_shape)
+        new._cached = None
+        super(LogitNormal, new).__init__(batch_shape, validate_args=False)
+        new._validate_args = self._validate_args
+        return new
+
+    def rsample(self, sample_shape=torch.Size()):
+        shape = self._extended_shape(sample_shape)
+        eps = torch.randn(shape, dtype=self.loc.dtype, device=self.loc.device)
+        x = torch.addcmul(self.loc, self.scale, eps)
+        value = torch.sigmoid(x)
+        self._cached = (value, x)
+        return value
+
+    def logit(self, value):
+        if self._cached is not None and value is self._cached[0]:
+            return self._cached[1]
+        eps = torch.finfo(value.dtype).eps
+        return torch.logit(value, eps=eps)
+
+    def log_prob(self, value):
+        if self._validate_args:
+            self._validate_sample(value)
+        x = self.logit(value)
+        # log N(x | loc, scale) - log sigmoid'(x), with
+        # -log sigmoid'(x) = softplus(x) + softplus(-x) = |x| + 2 softplus(-|x|)
+        z = (x - self.loc) / self.scale
+        x = x.abs()
+        return (
+            -0.5 * z * z - self.scale.log() - 0.5 * math.log(2 * math.pi)
+            + x + 2.0 * torch.nn.functional.softplus(-x)
+        )
+
+    def normal(self):
+        return Normal(self.loc, self.scale)
+
+@register_kl(LogitNormal, LogitNormal)
+def _kl_logit_normal_logit_normal(p, q):
+    # invariant under the shared bijection
+    return kl_divergence(p.normal(), q.normal())
@@ -0,0 +1,98 @@
+import torch
+import pyro
+from pyro import poutine
+
+class ChunkedTraceMeanField_ELBO(pyro.infer.TraceMeanField_ELBO):
+    """Mean-field ELBO whose ``num_particles`` are evaluated in vectorized
+    chunks of at most ``chunk_size`` particles.
+
+    Each chunk is run with the model and guide scaled by its share of the
+    particles and backpropagated on its own, so gradients accumulate to
+    those of the full vectorized estimator while peak memory only grows
+    with ``chunk_size``.
+    """
+    def __init__(self, num_particles=1, chunk_size=1, **kwargs):
+        kwargs["vectorize_particles"] = True
+        super().__init__(num_particles=num_particles, **kwargs)
+        self.chunk_size = chunk_size
+        # the chunks share the (possibly guessed) self.max_plate_nesting
+        kwargs.pop("max_plate_nesting", None)
+        self._kwargs = kwargs
+        self._elbos = {}
+
+    def _chunks(self):
+        for start in range(0, self.num_particles, self.chunk_size):
+            num_particles = min(self.chunk_size, self.num_particles - start)
+            if num_particles not in self._elbos:
+                self._elbos[num_particles] = pyro.infer.TraceMeanField_ELBO(
+                    num_particles=num_particles, 
+                    max_plate_nesting=self.max_plate_nesting,
+                    **self._kwargs,
+                )
+            yield num_particles / self.num_particles, self._elbos[num_particles]
+
+    def loss(self, model, guide, *args, **kwargs):
+        loss = 0.0
+        for scale, elbo in self._chunks():
+            loss = loss + scale * elbo.loss(model, guide, *args, **kwargs)
+        return loss
+
+    def loss_and_grads(self, model, guide, *args, **kwargs):
+        loss = 0.0
+        for scale, elbo in self._chunks():
+            loss = loss + elbo.loss_and_grads(
+                poutine.scale(model, scale), 
+                poutine.scale(guide, scale), 
+                *args, **kwargs,
+            )
+        return loss
+
+def get_elbo(num_particles, chunk_size=0):
+    if chunk_size > 0 and chunk_size < num_particles:
+        return ChunkedTraceMeanField_ELBO(
+            num_particles=num_particles, chunk_size=chunk_size,
+        )
+    return pyro.infer.TraceMeanField_ELBO(
+        num_particles=num_particles, vectorize_particles=True,
+    )
+
+def all_reduce_gradients(params):
+    """Average the gradients of ``params`` across all workers of the
+    default process group with a single flat all-reduce."""
+    import torch.distributed as dist
+    grads = [
+        param.grad if param.grad is not None else torch.zeros_like(param)
+        for param in params
+    ]
+    flat = torch.cat([grad.flatten() for grad in grads])
+    dist.all_reduce(flat)
+    flat = flat / dist.get_world_size()
+    for param, grad in zip(params, flat.split([grad.numel() for grad in grads])):
+        param.grad = grad.view_as(param)
+
+class DistributedSVI(pyro.infer.SVI):
+    """Data-parallel SVI: every worker of the default process group runs
+    the ELBO on its own shard of the data, gradients are averaged across
+    workers before the (identical) optimizer step."""
+    def step(self, *args, **kwargs):
+        import torch.distributed as dist
+        with poutine.trace(param_only=True) as param_capture:
+            loss = self.loss_and_grads(self.model, self.guide, *args, **kwargs)
+
+        # same order on every worker
+        params = [
+            site["value"].unconstrained()
+            for name, site in sorted(param_capture.trace.nodes.items())
+        ]
+        all_reduce_gradients(params)
+        self.optim(params)
+        pyro.infer.util.zero_grads(params)
+
+        loss = torch.tensor(float(loss))
+        dist.all_reduce(loss)
+        return float(loss) / dist.get_world_size()
+
+def broadcast_parameters(module, src=0):
+    import torch.distributed as dist
+    for param in module.parameters():
+        dist.broadcast(param.data, src)
@@ -1,6 +1,7 @@
 import math
 from typing import Optional, Callable
 from functools import partial
+import numpy as np
 import torch
 import pyro
 from pyro import poutine
@@ -13,6 +14,10 @@ from dgl.nn.functional import edge_softmax
 
 from torchdiffeq import odeint_adjoint
 from torchdiffeq import odeint
+from .utils import add_reverse_edges
+from .coarsen import coarsen_hierarchy
+from .profiling import tag
+from .distributions import LogitNormal
 
 class ODEFunc(torch.nn.Module):
     def __init__(self, gamma):
@@ -21,10 +26,17 @@ class ODEFunc(torch.nn.Module):
         self.edge_shape = None
         self.node_shape = None
         self.h0 = None
+        self.boundaries = None
+        self.nfe = 0
         self.register_buffer("gamma", torch.tensor(gamma))
         
     def forward(self, t, x):
+        self.nfe += 1
         h, e = x[:self.node_shape.numel()], x[self.node_shape.numel():]
+        if self.boundaries is not None:
+            # piecewise-constant operator, one per layer
+            idx = int(torch.searchsorted(self.boundaries, t.reshape(1), right=True))
+            e = e[idx * self.edge_shape.numel():(idx + 1) * self.edge_shape.numel()]
         h, e = h.reshape(*self.node_shape), e.reshape(*self.edge_shape)
         h0 = h
         g = self.g.local_var()
@@ -37,52 +49,142 @@ class ODEFunc(torch.nn.Module):
         h = h - h0 * self.gamma
         if self.h0 is not None:
             h = h + self.h0
-        h, e = h.flatten(), e.flatten()
-        x = torch.cat([h, torch.zeros_like(e)])
+        h = h.flatten()
+        x = torch.cat([h, torch.zeros_like(x[self.node_shape.numel():])])
         return x
 
 class LinearDiffusion(torch.nn.Module):
-    def __init__(self, t, adjoint=False, physique=False, gamma=1.0):
+    def __init__(
+            self, t, adjoint=False, physique=False, gamma=1.0,
+            levels=0, fine_fraction=0.1,
+        ):
         super().__init__()
         self.odefunc = ODEFunc(gamma=gamma)
         self.register_buffer("t", torch.tensor(t))
         self.physique = physique
+        self.levels = levels
+        self.fine_fraction = fine_fraction
         if adjoint:
             self.integrator = odeint_adjoint
         else:
             self.integrator = odeint
         
 
-    def forward(self, g, h, e):
+    def normalize(self, g, e):
+        batch_dims = e.dim() - 3
+        if batch_dims > 0:
+            e = e.movedim(batch_dims, 0)
+        g.edata["e"] = e
+        g.update_all(fn.copy_e("e", "m"), fn.sum("m", "e_sum"))
+        g.apply_edges(lambda edges: {"e": edges.data["e"] / edges.dst["e_sum"]})
+        return g.edata["e"]
+
+    def forward(self, g, h, e, ts=None):
+        """Diffuse ``h`` with the edge weights ``e`` for time ``t``.
+
+        If ``e`` is a list of edge weights, they are applied one after the
+        other for the durations ``ts`` within a single solve, the solver
+        stopping at (but carrying its step size across) the boundaries.
+
+        With ``levels > 0`` the first ``1 - fine_fraction`` of the time is
+        solved on a coarsened graph (see :meth:`solve_multilevel`).
+        """
         g = g.local_var()
+        es = list(e) if isinstance(e, (list, tuple)) else [e]
 
-        parallel = e.dim() == 4
+        # leading (particle / configuration) batch dimensions of e
+        batch_dims = es[0].dim() - 3
+        parallel = batch_dims > 0
         if parallel:
-            if h.dim() == 2:
-                h = h.broadcast_to(e.shape[0], *h.shape)
-            e, h = e.swapaxes(0, 1), h.swapaxes(0, 1)
+            h = h.broadcast_to(*es[0].shape[:batch_dims], *h.shape[-2:])
+            h = h.movedim(batch_dims, 0)
+
+        h = h.reshape(*h.shape[:-1], es[0].shape[-2], -1)
+        es = [self.normalize(g, e) for e in es]
+        if len(es) > 1:
+            if self.levels > 0:
+                raise ValueError(
+                    "Multilevel diffusion of several operators is not supported."
+                )
+            h = self.solve(g, h, es, ts)
+        elif self.levels > 0:
+            h = self.solve_multilevel(g, h, es[0])
+        else:
+            h = self.solve(g, h, es, [self.t])
+        if parallel:
+            h = h.movedim(0, batch_dims)
+        h = h.flatten(-2, -1)
+        return h
 
-        h = h.reshape(*h.shape[:-1], e.shape[-2], -1)
-        g.edata["e"] = e
-        g.update_all(fn.copy_e("e", "m"), fn.sum("m", "e_sum"))
-        g.apply_edges(lambda edges: {"e": edges.data["e"] / edges.dst["e_sum"]})
+    def solve(self, g, h, es, ts, h0=None):
+        """Integrate the (node-first) features ``h`` with the normalized
+        edge weights ``es[i]`` for the durations ``ts[i]``."""
         node_shape = h.shape
         if self.physique:
-            self.odefunc.h0 = h.detach().clone()
+            self.odefunc.h0 = h.detach().clone() if h0 is None else h0
         self.odefunc.node_shape = node_shape
-        self.odefunc.edge_shape = g.edata["e"].shape
+        self.odefunc.edge_shape = es[0].shape
         self.odefunc.g = g
-        t = torch.tensor([0.0, self.t], device=h.device, dtype=h.dtype)
-        x = torch.cat([h.flatten(), g.edata["e"].flatten()])
-        x = self.integrator(self.odefunc, x, t, method="dopri5")[-1]
+
+        options = None
+        self.odefunc.boundaries = None
+        ts = torch.stack(
+            [torch.as_tensor(t, device=h.device, dtype=h.dtype) for t in ts]
+        )
+        if len(es) > 1:
+            self.odefunc.boundaries = torch.cumsum(ts, 0)[:-1]
+            options = {"jump_t": self.odefunc.boundaries}
+        t = torch.stack([ts.new_zeros(()), ts.sum()])
+        x = torch.cat([h.flatten()] + [e.flatten() for e in es])
+        x = self.integrator(self.odefunc, x, t, method="dopri5", options=options)[-1]
         # x = self.integrator(self.odefunc, x, t, method="rk4", options={"step_size": 0.1})[-1]
-        h, e = x[:h.numel()], x[h.numel():]
-        h = h.reshape(*node_shape)
-        if parallel:
-            h = h.swapaxes(0, 1)
-        h = h.flatten(-2, -1)
+        h = x[:h.numel()]
+        return h.reshape(*node_shape)
+
+    def solve_multilevel(self, g, h, e):
+        """Restrict ``h`` and the normalized edge weights ``e`` to the
+        coarsest level of the (cached) heavy-edge-matching hierarchy of
+        ``g``, diffuse there for ``(1 - fine_fraction) * t``, prolong
+        back and correct on ``g`` for the remaining ``fine_fraction * t``.
+
+        The smooth (low-frequency) part of the solution is what survives
+        long diffusion times and is well resolved on the coarse graph;
+        the short fine solve restores the local detail. Use
+        :meth:`multilevel_error` to measure the error of the split.
+        """
+        hierarchy = coarsen_hierarchy(g, self.levels)
+        if len(hierarchy) == 0 or self.fine_fraction >= 1:
+            return self.solve(g, h, [e], [self.t])
+        h0 = h.detach().clone() if self.physique else None
+        h_coarse, h0_coarse, e_coarse = h, h0, e
+        for level in hierarchy:
+            h_coarse = level.restrict_nodes(h_coarse)
+            e_coarse = level.restrict_edges(e_coarse)
+            if h0_coarse is not None:
+                h0_coarse = level.restrict_nodes(h0_coarse)
+        t_fine = self.t * self.fine_fraction
+        h = self.solve(
+            hierarchy[-1].g, h_coarse, [e_coarse], [self.t - t_fine], h0=h0_coarse,
+        )
+        for level in reversed(hierarchy):
+            h = level.prolong(h)
+        if self.fine_fraction > 0:
+            h = self.solve(g, h, [e], [t_fine], h0=h0)
         return h
 
+    @torch.no_grad()
+    def multilevel_error(self, g, h, e):
+        """Relative error (Frobenius norm) of the multilevel solution
+        w.r.t. the single fine-level solve."""
+        levels = self.levels
+        try:
+            self.levels = 0
+            exact = self(g, h, e)
+        finally:
+            self.levels = levels
+        approx = self(g, h, e)
+        return float((approx - exact).norm() / exact.norm().clamp(min=1e-12))
+
 class BronxLayer(pyro.nn.PyroModule):
     def __init__(
             self, 
@@ -100,6 +202,8 @@ class BronxLayer(pyro.nn.PyroModule):
             norm=False,
             dropout=0.0,
             node_prior=False,
+            multilevel=0,
+            fine_fraction=0.1,
         ):
         super().__init__()
         self.fc_mu = torch.nn.Linear(in_features, out_features, bias=False)
@@ -124,6 +228,7 @@ class BronxLayer(pyro.nn.PyroModule):
         self.kl_scale = kl_scale
         self.linear_diffusion = LinearDiffusion(
             t, adjoint=adjoint, physique=physique, gamma=gamma,
+            levels=multilevel, fine_fraction=fine_fraction,
         )
 
 
@@ -135,6 +240,14 @@ class BronxLayer(pyro.nn.PyroModule):
         self.dropout = torch.nn.Dropout(dropout)
 
     def guide(self, g, h):
+        h, e = self.guide_edges(g, h)
+        with tag("diffusion"):
+            h = self.linear_diffusion(g, h, e)
+        return h
+
+    def guide_edges(self, g, h):
+        """Sample the edge weights from the variational posterior and
+        return them with the node features to diffuse."""
         g = g.local_var()
         if self.norm:
             h = self.norm(h)
@@ -164,26 +277,28 @@ class BronxLayer(pyro.nn.PyroModule):
         if parallel:
             mu, log_sigma = mu.swapaxes(0, 1), log_sigma.swapaxes(0, 1)
 
-        with pyro.plate(
+        with tag("sample"), pyro.plate(
             f"edges{self.idx}", g.number_of_edges(), device=g.device
         ):
             with pyro.poutine.scale(None, self.kl_scale):
                 e = pyro.sample(
                     f"e{self.idx}",
-                    pyro.distributions.TransformedDistribution(
-                        pyro.distributions.Normal(
-                            mu,
-                            self.sigma_factor * log_sigma.exp(),
-                        ),
-                        pyro.distributions.transforms.SigmoidTransform(),
+                    LogitNormal(
+                        mu, self.sigma_factor * log_sigma.exp(),
                     ).to_event(2),
                 )
-        h = self.linear_diffusion(g, h, e)
-        return h
+        return h, e
 
     def forward(self, g, h, he=None):
-        g = g.local_var()
+        h, e = self.prior_edges(g, h)
+        with tag("diffusion"):
+            h = self.linear_diffusion(g, h, e)
+        return h
 
+    def prior_edges(self, g, h):
+        """Sample the edge weights from the prior and return them with the
+        node features to diffuse."""
+        g = g.local_var()
 
         if self.node_prior:
             if self.norm:
@@ -191,8 +306,8 @@ class BronxLayer(pyro.nn.PyroModule):
             # h = self.dropout(h)
             mu, log_sigma = self.fc_mu_prior(h), self.fc_log_sigma_prior(h)
             src, dst = g.edges()
-            mu = mu[..., dst, :]
-            log_sigma = log_sigma[..., dst, :]
+            mu = mu[..., dst.long(), :]
+            log_sigma = log_sigma[..., dst.long(), :]
             mu, log_sigma = mu.unsqueeze(-1), log_sigma.unsqueeze(-1)
             sigma = log_sigma.exp() * self.sigma_factor
 
@@ -211,20 +326,188 @@ class BronxLayer(pyro.nn.PyroModule):
                 device=g.device,
             )
 
-        with pyro.plate(
+        with tag("sample"), pyro.plate(
             f"edges{self.idx}", g.number_of_edges(), device=g.device
         ):
             with pyro.poutine.scale(None, self.kl_scale):
                 e = pyro.sample(
                     f"e{self.idx}",
-                    pyro.distributions.TransformedDistribution(
-                        pyro.distributions.Normal(
-                            mu, sigma,
-                        ),
-                        pyro.distributions.transforms.SigmoidTransform(),
-                    ).to_event(2),
+                    LogitNormal(mu, sigma).to_event(2),
                 )
+        return h, e
+
+class StackedLinear(torch.nn.Module):
+    """``num_stacks`` independent bias-free linear maps applied to
+    inputs of shape (..., num_stacks, N, in_features), or (N, in_features)
+    shared by all stacks.
 
+    Every stack owns a separate parameter ``weight_{k}`` so that it can be
+    optimized with its own hyperparameters."""
+    def __init__(self, num_stacks, in_features, out_features, init=None):
+        super().__init__()
+        self.num_stacks = num_stacks
+        for idx in range(num_stacks):
+            linear = torch.nn.Linear(in_features, out_features, bias=False)
+            if init is not None:
+                torch.nn.init.constant_(linear.weight, init)
+            self.register_parameter(f"weight_{idx}", linear.weight)
+
+    @property
+    def weight(self):
+        return torch.stack(
+            [getattr(self, f"weight_{idx}") for idx in range(self.num_stacks)]
+        )
+
+    def forward(self, h):
+        if h.dim() == 2:
+            h = h.unsqueeze(0)
+        return h @ self.weight.transpose(-1, -2)
+
+class StackedLayerNorm(torch.nn.Module):
+    def __init__(self, num_stacks, in_features):
+        super().__init__()
+        self.num_stacks = num_stacks
+        self.in_features = in_features
+        for idx in range(num_stacks):
+            self.register_parameter(
+                f"weight_{idx}", torch.nn.Parameter(torch.ones(in_features))
+            )
+            self.register_parameter(
+                f"bias_{idx}", torch.nn.Parameter(torch.zeros(in_features))
+            )
+
+    def forward(self, h):
+        weight = torch.stack(
+            [getattr(self, f"weight_{idx}") for idx in range(self.num_stacks)]
+        ).unsqueeze(-2)
+        bias = torch.stack(
+            [getattr(self, f"bias_{idx}") for idx in range(self.num_stacks)]
+        ).unsqueeze(-2)
+        h = torch.nn.functional.layer_norm(h, (self.in_features,))
+        return h * weight + bias
+
+class StackedBronxLayer(pyro.nn.PyroModule):
+    """:class:`BronxLayer` for a stack of configurations that share the
+    architecture but not the parameters, ``sigma_factor`` or ``kl_scale``
+    (one entry per configuration).
+
+    Node features have shape (..., num_stacks, N, in_features) and the
+    configurations are a plate at dim -2, inside which the edges are a
+    plate at dim -1.
+    """
+    def __init__(
+            self, 
+            num_stacks,
+            in_features, 
+            out_features, 
+            idx=0, 
+            num_heads=4,
+            sigma_factor=1.0,
+            kl_scale=1.0,
+            t=1.0,
+            adjoint=False,
+            physique=False,
+            gamma=1.0,
+            norm=False,
+            dropout=0.0,
+            node_prior=False,
+        ):
+        super().__init__()
+        self.fc_mu = StackedLinear(num_stacks, in_features, out_features, init=1e-5)
+        self.fc_log_sigma = StackedLinear(num_stacks, in_features, out_features, init=1e-5)
+        self.fc_k = StackedLinear(num_stacks, in_features, out_features, init=1e-5)
+        if node_prior:
+            self.fc_mu_prior = StackedLinear(num_stacks, in_features, num_heads)
+            self.fc_log_sigma_prior = StackedLinear(num_stacks, in_features, num_heads)
+        self.node_prior = node_prior
+        self.idx = idx
+        self.num_stacks = num_stacks
+        self.num_heads = num_heads
+        self.register_buffer(
+            "sigma_factor", 
+            torch.as_tensor(sigma_factor, dtype=torch.float).expand(num_stacks).clone(),
+        )
+        self.register_buffer(
+            "kl_scale", 
+            torch.as_tensor(kl_scale, dtype=torch.float).expand(num_stacks).clone(),
+        )
+        self.linear_diffusion = LinearDiffusion(
+            t, adjoint=adjoint, physique=physique, gamma=gamma,
+        )
+
+        if norm:
+            self.norm = StackedLayerNorm(num_stacks, in_features)
+        else:
+            self.norm = None
+
+        self.dropout = torch.nn.Dropout(dropout)
+
+    def configs(self, g):
+        return pyro.plate("configs", self.num_stacks, dim=-2, device=g.device)
+
+    def _sample(self, g, mu, sigma, configs=None):
+        # a plate may only be constructed once per trace, so models pass
+        # the one shared with their other configuration-batched sites
+        if configs is None:
+            configs = self.configs(g)
+        with configs:
+            with pyro.plate(
+                f"edges{self.idx}", g.number_of_edges(), dim=-1, device=g.device
+            ):
+                with pyro.poutine.scale(None, self.kl_scale.unsqueeze(-1)):
+                    e = pyro.sample(
+                        f"e{self.idx}",
+                        LogitNormal(mu, sigma).to_event(2),
+                    )
+        return e
+
+    def guide(self, g, h, configs=None):
+        g = g.local_var()
+        if self.norm:
+            h = self.norm(h)
+        h = self.dropout(h)
+        mu, log_sigma, k = self.fc_mu(h), self.fc_log_sigma(h), self.fc_k(h)
+        mu = mu.reshape(*mu.shape[:-1], self.num_heads, -1)
+        log_sigma = log_sigma.reshape(*log_sigma.shape[:-1], self.num_heads, -1)
+        k = k.reshape(*k.shape[:-1], self.num_heads, -1)
+
+        # nodes first for message passing: (N, ..., num_stacks, heads, d)
+        batch_dims = mu.dim() - 3
+        mu, log_sigma, k = (
+            x.movedim(batch_dims, 0) for x in (mu, log_sigma, k)
+        )
+        g.ndata["mu"], g.ndata["log_sigma"], g.ndata["k"] = mu, log_sigma, k
+        g.apply_edges(dgl.function.u_dot_v("k", "mu", "mu"))
+        g.apply_edges(dgl.function.u_dot_v("k", "log_sigma", "log_sigma"))
+        mu = g.edata["mu"].movedim(0, batch_dims)
+        log_sigma = g.edata["log_sigma"].movedim(0, batch_dims)
+
+        sigma = self.sigma_factor.reshape(-1, 1, 1, 1) * log_sigma.exp()
+        e = self._sample(g, mu, sigma, configs)
+        h = self.linear_diffusion(g, h, e)
+        return h
+
+    def forward(self, g, h, configs=None):
+        g = g.local_var()
+        if self.node_prior:
+            # as in BronxLayer.prior_edges, per configuration
+            if self.norm:
+                h = self.norm(h)
+            mu, log_sigma = self.fc_mu_prior(h), self.fc_log_sigma_prior(h)
+            dst = g.edges()[1].long()
+            mu = mu[..., dst, :].unsqueeze(-1)
+            log_sigma = log_sigma[..., dst, :].unsqueeze(-1)
+            sigma = self.sigma_factor.reshape(-1, 1, 1, 1) * log_sigma.exp()
+        else:
+            mu = torch.zeros(
+                self.num_stacks,
+                g.number_of_edges(),
+                self.num_heads,
+                1,
+                device=g.device,
+            )
+            sigma = self.sigma_factor.reshape(-1, 1, 1, 1) * torch.ones_like(mu)
+        e = self._sample(g, mu, sigma, configs)
         h = self.linear_diffusion(g, h, e)
         return h
 
@@ -248,38 +531,48 @@ class NodeRecover(pyro.nn.PyroModule):
                 )
 
 class EdgeRecover(pyro.nn.PyroModule):
-    def __init__(self, in_features, out_features, scale=1.0):
+    def __init__(self, in_features, out_features, scale=1.0, num_negatives=1):
         super().__init__()
         self.fc = torch.nn.Linear(in_features, out_features, bias=False)
         self.scale = scale
+        self.num_negatives = num_negatives
 
     def forward(self, g, h):
-        g = g.local_var()
         h = self.fc(h)
-        g = dgl.add_reverse_edges(g)
-        src, dst = g.edges()
-        src_fake = torch.randint(high=g.number_of_nodes(), size=(g.number_of_edges(),), device=g.device)
-        dst_fake = torch.randint(high=g.number_of_nodes(), size=(g.number_of_edges(),), device=g.device)
+        g = add_reverse_edges(g)
+        num_fake = g.number_of_edges() * self.num_negatives
+        src_fake = torch.randint(high=g.number_of_nodes(), size=(num_fake,), device=g.device, dtype=g.idtype)
+        dst_fake = torch.randint(high=g.number_of_nodes(), size=(num_fake,), device=g.device, dtype=g.idtype)
+        g_fake = dgl.graph(
+            (src_fake, dst_fake), num_nodes=g.number_of_nodes(), idtype=g.idtype,
+        )
+
+        parallel = h.dim() == 3
+        if parallel:
+            h = h.swapaxes(0, 1)
+
+        # fused gather-dot (SDDMM) scores, no E x D intermediates
+        score_real = dgl.ops.u_dot_v(g, h, h).squeeze(-1)
+        score_fake = dgl.ops.u_dot_v(g_fake, h, h).squeeze(-1)
+
+        if parallel:
+            score_real, score_fake = score_real.swapaxes(0, 1), score_fake.swapaxes(0, 1)
 
         with pyro.poutine.scale(None, self.scale):
             with pyro.plate("real_edges", g.number_of_edges(), device=g.device):
                 pyro.sample(
                     "edge_recover_real",
-                    pyro.distributions.Bernoulli(
-                            (h[..., src, :] * h[..., dst, :]).sum(-1).sigmoid(),
-                    ),
-                    obs=torch.ones(g.number_of_edges(), device=g.device),
+                    pyro.distributions.Bernoulli(logits=score_real),
+                    obs=score_real.new_ones(g.number_of_edges()),
                 )
 
-                pyro.sample(
-                    "edge_recover_fake",
-                    pyro.distributions.Bernoulli(
-                        torch.sigmoid(
-                            (h[..., src_fake, :] * h[..., dst_fake, :]).sum(-1)
-                        ),
-                    ),
-                    obs=torch.zeros(g.number_of_edges(), device=g.device),
-                )
+            with pyro.poutine.scale(None, 1.0 / self.num_negatives):
+                with pyro.plate("fake_edges", num_fake, device=g.device):
+                    pyro.sample(
+                        "edge_recover_fake",
+                        pyro.distributions.Bernoulli(logits=score_fake),
+                        obs=score_fake.new_zeros(num_fake),
+                    )
 
 class NeighborhoodRecover(pyro.nn.PyroModule):
     def __init__(self, in_features, scale=1.0):
@@ -289,23 +582,56 @@ class NeighborhoodRecover(pyro.nn.PyroModule):
         self.scale = scale
 
     def forward(self, g, h):
-        g = g.local_var()
-        g = dgl.add_reverse_edges(g)
+        g = add_reverse_edges(g)
         mu, log_sigma = self.fc_mu(h), self.fc_log_sigma(h)
-        src, dst = g.edges()
-        mu, log_sigma = mu[..., src, :], log_sigma[..., src, :]
-        h = h[..., dst, :]
+
+        parallel = h.dim() == 3
+        if parallel:
+            mu, log_sigma, h = mu.swapaxes(0, 1), log_sigma.swapaxes(0, 1), h.swapaxes(0, 1)
+
+        # log N(h_dst | mu_src, sigma_src), with the residual taken per edge
+        # rather than expanded, which would cancel catastrophically
+        z = dgl.ops.e_mul_u(g, dgl.ops.v_sub_u(g, h, mu), (-log_sigma).exp())
+        log_prob = -0.5 * z.pow(2).sum(-1) - log_sigma.sum(-1)[g.edges()[0].long()]
+        log_prob = log_prob - 0.5 * h.shape[-1] * math.log(2 * math.pi)
+
+        if parallel:
+            log_prob = log_prob.swapaxes(0, 1)
 
         with pyro.poutine.scale(None, self.scale):
             with pyro.plate("neighborhood_recover_plate", g.number_of_edges(), device=g.device):
-                pyro.sample(
-                    "neighborhood_recover",
-                    pyro.distributions.Normal(
-                        mu, 
-                        log_sigma.exp(),
-                    ).to_event(1),
-                    obs=h,
-                )
+                pyro.factor("neighborhood_recover", log_prob)
+
+def feature_chunks(features, chunk_size, like):
+    for start in range(0, features.shape[0], chunk_size):
+        chunk = features[start:start+chunk_size]
+        if not isinstance(chunk, torch.Tensor):
+            chunk = torch.from_numpy(np.ascontiguousarray(chunk))
+        yield start, chunk.to(device=like.device, dtype=like.dtype)
+
+class StreamedLinear(torch.autograd.Function):
+    """Bias-free linear projection of (possibly memory-mapped) node features
+    computed in node chunks; the features are re-read chunk by chunk in the
+    backward pass instead of being kept in memory."""
+    @staticmethod
+    def forward(ctx, weight, features, chunk_size):
+        ctx.features, ctx.chunk_size = features, chunk_size
+        ctx.save_for_backward(weight)
+        h = torch.empty(
+            features.shape[0], weight.shape[0], 
+            device=weight.device, dtype=weight.dtype,
+        )
+        for start, chunk in feature_chunks(features, chunk_size, weight):
+            torch.matmul(chunk, weight.t(), out=h[start:start+chunk.shape[0]])
+        return h
+
+    @staticmethod
+    def backward(ctx, grad):
+        weight, = ctx.saved_tensors
+        grad_weight = torch.zeros_like(weight)
+        for start, chunk in feature_chunks(ctx.features, ctx.chunk_size, weight):
+            grad_weight.addmm_(grad[start:start+chunk.shape[0]].t(), chunk)
+        return grad_weight, None, None
 
 class BatchedLSTM(torch.nn.LSTM):
     def forward(self, h):
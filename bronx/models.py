@@ -1,10 +1,14 @@
 import math
+import numpy as np
 import torch
 import dgl
 import pyro
 from pyro import poutine
-from .layers import BronxLayer, NodeRecover, EdgeRecover, NeighborhoodRecover, ConsistencyRegularizer
+from .layers import BronxLayer, NodeRecover, EdgeRecover, ConsistencyRegularizer, StreamedLinear
+from .layers import StackedBronxLayer, StackedLinear
 from dgl.nn.pytorch import GraphConv
+from .profiling import tag
+from . import utils
 
 class BronxModel(pyro.nn.PyroModule):
     def __init__(
@@ -26,8 +30,21 @@ class BronxModel(pyro.nn.PyroModule):
             norm=False,
             node_prior=False,
             edge_recover=0.0,
+            edge_recover_negatives=1,
+            chunk_size=None,
+            hidden_cache=None,
+            fused=False,
+            multilevel=0,
+            fine_fraction=0.1,
         ):
         super().__init__()
+        if fused and multilevel > 0:
+            # the fused solve integrates all layers at once on the fine graph
+            raise ValueError("fused diffusion does not support multilevel solves.")
+        if fused and physique:
+            # the source term of every layer is its own input, which the
+            # single solve only has for the first layer
+            raise ValueError("fused diffusion does not support physique.")
         if embedding_features is None:
             embedding_features = hidden_features
 
@@ -57,10 +74,16 @@ class BronxModel(pyro.nn.PyroModule):
         )
         self.activation = activation
         self.depth = depth
+        self.fused = fused
+        self.chunk_size = chunk_size
+        self.hidden_cache = hidden_cache
+        self._hidden = None
+        self._hidden_key = None
 
         if edge_recover > 0:
             self.edge_recover = EdgeRecover(
                 hidden_features, hidden_features, scale=edge_recover,
+                num_negatives=edge_recover_negatives,
             )
         else:
             self.edge_recover = None
@@ -81,6 +104,8 @@ class BronxModel(pyro.nn.PyroModule):
                 norm=norm,
                 dropout=dropout_in,
                 node_prior=node_prior,
+                multilevel=multilevel,
+                fine_fraction=fine_fraction,
             )
             
             if idx > 0:
@@ -93,22 +118,117 @@ class BronxModel(pyro.nn.PyroModule):
                 layer,
             )
 
+    @property
+    def nfe(self):
+        return sum(
+            getattr(self, f"layer{idx}").linear_diffusion.odefunc.nfe
+            for idx in range(self.depth)
+        )
+
+    def reset_nfe(self):
+        for idx in range(self.depth):
+            getattr(self, f"layer{idx}").linear_diffusion.odefunc.nfe = 0
+
+    def project(self, h):
+        # node features may be a memory-mapped array (e.g. np.load(path,
+        # mmap_mode="r")), in which case fc_in is applied in node chunks
+        streamed = not isinstance(h, torch.Tensor) or self.chunk_size is not None
+        if not streamed:
+            return self.fc_in(h)
+
+        weight = self.fc_in[0].weight
+        chunk_size = self.chunk_size or 65536
+        if self.hidden_cache is None or torch.is_grad_enabled():
+            return StreamedLinear.apply(weight, h, chunk_size)
+
+        # at inference time the projection is written to disk once and
+        # memory-mapped back for as long as the weights do not change
+        key = (id(h), weight._version, weight.data_ptr())
+        if self._hidden_key != key:
+            hidden = np.lib.format.open_memmap(
+                self.hidden_cache, mode="w+", 
+                dtype=np.float32, shape=(h.shape[0], weight.shape[0]),
+            )
+            for start in range(0, h.shape[0], chunk_size):
+                chunk = StreamedLinear.apply(weight, h[start:start+chunk_size], chunk_size)
+                hidden[start:start+chunk_size] = chunk.cpu().numpy()
+            hidden.flush()
+            del hidden
+            self._hidden = torch.from_numpy(
+                np.load(self.hidden_cache, mmap_mode="r+")
+            )
+            self._hidden_key = key
+        return self._hidden.to(device=weight.device, dtype=weight.dtype)
+
+    def __getstate__(self):
+        # do not pickle the memory-mapped hidden cache with checkpoints
+        state = getattr(super(), "__getstate__", lambda: self.__dict__)()
+        state = dict(state)
+        state["_hidden"], state["_hidden_key"] = None, None
+        return state
+
+    def check_graph(self, g):
+        if utils.BENCHMARK:
+            utils.check_prepared(g, reverse=self.edge_recover is not None)
+
     def guide(self, g, h, *args, **kwargs):
+        self.check_graph(g)
         g = g.local_var()
-        h = self.fc_in(h)        
-        for idx in range(self.depth):
-            h = getattr(self, f"layer{idx}").guide(g, h)
-        h = self.fc_out(h)
+        with tag("fc_in"):
+            h = self.project(h)
+        if self.fused:
+            # the edge posteriors only need the input, no diffusion
+            for idx in range(self.depth):
+                with tag(f"layer{idx}.guide"):
+                    getattr(self, f"layer{idx}").guide_edges(g, h)
+        else:
+            for idx in range(self.depth):
+                with tag(f"layer{idx}.guide"):
+                    h = getattr(self, f"layer{idx}").guide(g, h)
+        with tag("readout"):
+            h = self.fc_out(h)
         return h
 
+    def diffuse_fused(self, g, h):
+        """Sample every layer's operator from the input features ``h`` and
+        apply them one after another in a single solve over [0, t].
+
+        For ``depth == 1`` this is the unfused model. For ``depth > 1`` it
+        is a different model, not an equivalent rewrite of the stacked
+        layers: the edge posteriors of layer ``idx > 0`` (see the fused
+        ``guide``) are computed from the input rather than from the
+        output of layer ``idx - 1``, which changes the posterior. With
+        ``physique`` every layer's source term would be its own input, so
+        the two are not combined.
+        """
+        es, ts = [], []
+        for idx in range(self.depth):
+            layer = getattr(self, f"layer{idx}")
+            with tag(f"layer{idx}"):
+                _h, e = layer.prior_edges(g, h)
+            if idx == 0:
+                h0 = _h
+            es.append(e)
+            ts.append(layer.linear_diffusion.t)
+        with tag("diffusion"):
+            return self.layer0.linear_diffusion(g, h0, es, ts=ts)
+
     def forward(self, g, h, *args, **kwargs):
+        self.check_graph(g)
         g = g.local_var()
-        h = self.fc_in(h)
-        for idx in range(self.depth):
-            h = getattr(self, f"layer{idx}")(g, h)
+        with tag("fc_in"):
+            h = self.project(h)
+        if self.fused:
+            h = self.diffuse_fused(g, h)
+        else:
+            for idx in range(self.depth):
+                with tag(f"layer{idx}"):
+                    h = getattr(self, f"layer{idx}")(g, h)
         if self.edge_recover is not None:
-            self.edge_recover(g, h)
-        h = self.fc_out(h)
+            with tag("recover"):
+                self.edge_recover(g, h)
+        with tag("readout"):
+            h = self.fc_out(h)
         return h
 
 class NodeClassificationBronxModel(BronxModel):
@@ -123,27 +243,146 @@ class NodeClassificationBronxModel(BronxModel):
     def forward(self, g, h, y=None, mask=None):
         h = super().forward(g, h, )
         h = h.softmax(-1)
-        self.consistency_regularizer(h)
+        with tag("recover"):
+            self.consistency_regularizer(h)
+
+        # integer class indices by default, one-hot labels for compatibility
+        one_hot = y is not None and y.dim() > 1
 
         if mask is not None:
             h = h[..., mask, :]
             if y is not None:
-                y = y[..., mask, :]
+                y = y[..., mask, :] if one_hot else y[..., mask]
 
         if y is not None:
+            if one_hot:
+                likelihood = pyro.distributions.OneHotCategorical(probs=h)
+            else:
+                likelihood = pyro.distributions.Categorical(probs=h)
+
             with pyro.plate(
                 "data", y.shape[0], 
                 device=h.device, 
             ):
                 pyro.sample(
                     "y",
-                    pyro.distributions.OneHotCategorical(probs=h),
+                    likelihood,
                     obs=y,
                 )
 
         return h 
 
 
+class StackedNodeClassificationBronxModel(pyro.nn.PyroModule):
+    """A stack of ``num_stacks`` node classification models sharing the
+    architecture (``hidden_features``, ``num_heads``, ``depth``, ...) and
+    trained together in one vectorized forward / guide.
+
+    ``sigma_factor`` and ``kl_scale`` may be given per configuration;
+    there is no edge recovery (``edge_recover``). The
+    outputs have shape (..., num_stacks, N, out_features) and the ELBO is
+    the sum of the independent per-configuration ELBOs, so every
+    configuration receives the gradients of its own.
+    """
+    def __init__(
+            self, num_stacks, in_features, hidden_features, out_features, 
+            embedding_features=None,
+            activation=torch.nn.SiLU(),
+            depth=1,
+            num_heads=4,
+            sigma_factor=1.0,
+            kl_scale=1.0,
+            t=1.0,
+            adjoint=False,
+            physique=False,
+            gamma=1.0,
+            dropout_in=0.0,
+            dropout_out=0.0,
+            norm=False,
+            node_prior=False,
+            consistency_temperature=1.0,
+            consistency_factor=1.0,
+        ):
+        super().__init__()
+        if embedding_features is None:
+            embedding_features = hidden_features
+        self.num_stacks = num_stacks
+        self.depth = depth
+        self.fc_in = StackedLinear(num_stacks, in_features, hidden_features)
+        self.fc_out = torch.nn.Sequential(
+            activation,
+            torch.nn.Dropout(dropout_out),
+            StackedLinear(num_stacks, hidden_features, out_features),
+        )
+
+        for idx in range(depth):
+            layer = StackedBronxLayer(
+                num_stacks,
+                hidden_features,
+                embedding_features,
+                idx=idx,
+                num_heads=num_heads,
+                sigma_factor=sigma_factor,
+                kl_scale=kl_scale,
+                t=t/depth,
+                adjoint=adjoint,
+                physique=physique,
+                gamma=gamma,
+                norm=norm,
+                dropout=dropout_in,
+                node_prior=node_prior,
+            )
+
+            if idx > 0:
+                layer.fc_mu = self.layer0.fc_mu
+                layer.fc_log_sigma = self.layer0.fc_log_sigma
+
+            setattr(self, f"layer{idx}", layer)
+
+        self.consistency_regularizer = ConsistencyRegularizer(
+            temperature=consistency_temperature, factor=consistency_factor,
+        )
+
+    def guide(self, g, h, *args, **kwargs):
+        if utils.BENCHMARK:
+            utils.check_prepared(g)
+        g = g.local_var()
+        configs = self.layer0.configs(g)
+        h = self.fc_in(h)
+        for idx in range(self.depth):
+            h = getattr(self, f"layer{idx}").guide(g, h, configs)
+        return h
+
+    def forward(self, g, h, y=None, mask=None):
+        if utils.BENCHMARK:
+            utils.check_prepared(g)
+        g = g.local_var()
+        configs = self.layer0.configs(g)
+        h = self.fc_in(h)
+        for idx in range(self.depth):
+            h = getattr(self, f"layer{idx}")(g, h, configs)
+        h = self.fc_out(h)
+        h = h.softmax(-1)
+
+        # average over particles only, never over configurations
+        self.consistency_regularizer(h if h.dim() > 3 else h.unsqueeze(0))
+
+        if mask is not None:
+            h = h[..., mask, :]
+            if y is not None:
+                y = y[..., mask]
+
+        if y is not None:
+            with configs:
+                with pyro.plate("data", y.shape[-1], dim=-1, device=h.device):
+                    pyro.sample(
+                        "y",
+                        pyro.distributions.Categorical(probs=h),
+                        obs=y.expand(h.shape[:-1]),
+                    )
+
+        return h
+
 class GraphRegressionBronxModel(BronxModel):
     def __init__(self, *args, **kwargs):
         out_features = kwargs["out_features"]
@@ -191,14 +430,15 @@ class GraphRegressionBronxModel(BronxModel):
         if parallel:
             h = h.swapaxes(0, 1)
             
-        g.ndata["h"] = h
-        h = dgl.sum_nodes(g, "h")
+        with tag("readout"):
+            g.ndata["h"] = h
+            h = dgl.sum_nodes(g, "h")
 
-        if parallel:
-            h = h.swapaxes(0, 1)
+            if parallel:
+                h = h.swapaxes(0, 1)
 
-        mu = self.fc_mu(h)
-        log_sigma = self.fc_log_sigma(h)
+            mu = self.fc_mu(h)
+            log_sigma = self.fc_log_sigma(h)
 
         mu = mu * self.y_std + self.y_mean
         sigma = log_sigma.exp() * self.y_std ** 2
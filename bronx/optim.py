@@ -1,9 +1,167 @@
+import torch
 import pyro
-from torchcontrib.optim import SWA as _SWA
+
+def _copy_(dst, src):
+    if hasattr(torch, "_foreach_copy_"):
+        torch._foreach_copy_(dst, src)
+    else:
+        for d, s in zip(dst, src):
+            d.copy_(s)
+
+class WeightAverage(object):
+    """Stochastic weight averaging or exponential moving average of
+    parameters.
+
+    The averages live in one flat buffer per device and dtype and are
+    updated with fused ``torch._foreach`` ops, so an update costs a couple
+    of kernels regardless of the number of parameters.
+
+    Parameters
+    ----------
+    params : iterable or Callable, optional
+        The parameters, or a function returning them. By default the
+        unconstrained parameters of the pyro param store, collected at the
+        first update since pyro creates them lazily.
+    decay : float, optional
+        EMA decay; equal-weight (SWA) averaging if not given.
+    start : int
+        Number of updates before averaging starts.
+    freq : int
+        Average every ``freq`` updates.
+    """
+    def __init__(self, params=None, decay=None, start=0, freq=1):
+        self.params = params
+        self.decay = decay
+        self.start = start
+        self.freq = max(freq, 1)
+        self.num_steps = 0
+        self.num_averaged = 0
+        self.groups = None
+
+    def _build(self):
+        params = self.params
+        if params is None:
+            params = [
+                param for _, param in pyro.get_param_store().named_parameters()
+            ]
+        elif callable(params):
+            params = params()
+        groups = {}
+        for param in params:
+            groups.setdefault((param.device, param.dtype), []).append(param)
+        self.groups = []
+        for params in groups.values():
+            flat = torch.cat([param.detach().reshape(-1) for param in params])
+            self.groups.append((params, flat, self._views(flat, params)))
+
+    @staticmethod
+    def _views(flat, params):
+        return [
+            view.view_as(param) for view, param in zip(
+                flat.split([param.numel() for param in params]), params,
+            )
+        ]
+
+    def update(self, force=False):
+        """Count a step and average the current parameters in if it is
+        due (or if ``force``)."""
+        self.num_steps += 1
+        due = self.num_steps > self.start \
+            and (self.num_steps - self.start - 1) % self.freq == 0
+        if not (due or force):
+            return
+        if self.groups is None:
+            self._build()
+        weight = 1.0 / (self.num_averaged + 1)
+        if self.decay is not None:
+            weight = max(1.0 - self.decay, weight)
+        with torch.no_grad():
+            for params, _, averaged in self.groups:
+                params = [param.detach() for param in params]
+                if hasattr(torch, "_foreach_lerp_"):
+                    torch._foreach_lerp_(averaged, params, weight)
+                else:
+                    torch._foreach_mul_(averaged, 1.0 - weight)
+                    torch._foreach_add_(averaged, params, alpha=weight)
+        self.num_averaged += 1
+
+    def swap(self):
+        """Swap the parameters and their averages in place."""
+        if self.num_averaged == 0:
+            return
+        with torch.no_grad():
+            for params, flat, averaged in self.groups:
+                params = [param.detach() for param in params]
+                tmp = flat.clone()
+                _copy_(averaged, params)
+                _copy_(params, self._views(tmp, params))
+
+    def averaged(self):
+        """Context manager evaluating with the averaged parameters."""
+        return _Swapped(self)
+
+class _Swapped(object):
+    def __init__(self, average):
+        self.average = average
+
+    def __enter__(self):
+        self.average.swap()
+        return self.average
+
+    def __exit__(self, *args):
+        self.average.swap()
+
+class SWAOptimizer(torch.optim.Optimizer):
+    """Drop-in for ``torchcontrib.optim.SWA`` on top of :class:`WeightAverage`.
+
+    Averages automatically when ``swa_start`` and ``swa_freq`` are given,
+    switching to ``swa_lr`` once averaging starts; otherwise call
+    :meth:`update_swa` manually. The param groups are shared with the
+    base optimizer, so LR schedulers such as ``ReduceLROnPlateau`` act on
+    it directly.
+    """
+    def __init__(self, optimizer, swa_start=None, swa_freq=None, swa_lr=None, decay=None):
+        self.optimizer = optimizer
+        self.param_groups = optimizer.param_groups
+        self.defaults = optimizer.defaults
+        self.state = optimizer.state
+        self.auto = swa_start is not None and swa_freq is not None
+        self.swa_lr = swa_lr
+        self.average = WeightAverage(
+            [param for group in self.param_groups for param in group["params"]],
+            decay=decay, start=swa_start or 0, freq=swa_freq or 1,
+        )
+
+    def step(self, closure=None):
+        if self.auto and self.swa_lr is not None \
+                and self.average.num_steps >= self.average.start:
+            for group in self.param_groups:
+                group["lr"] = self.swa_lr
+        loss = self.optimizer.step(closure)
+        if self.auto:
+            self.average.update()
+        return loss
+
+    def update_swa(self):
+        self.average.update(force=True)
+
+    def swap_swa_sgd(self):
+        self.average.swap()
+
+    def zero_grad(self, *args, **kwargs):
+        self.optimizer.zero_grad(*args, **kwargs)
+
+    def state_dict(self):
+        return self.optimizer.state_dict()
+
+    def load_state_dict(self, state_dict):
+        self.optimizer.load_state_dict(state_dict)
+        self.param_groups = self.optimizer.param_groups
+        self.state = self.optimizer.state
 
 def swa_constructor(param, base, base_args, swa_args):
     base = base(param, **base_args)
-    optimizer = _SWA(base, **swa_args)
+    optimizer = SWAOptimizer(base, **swa_args)
     return optimizer
 
 def SWA(args):
@@ -13,5 +171,18 @@ def SWA(args):
     )
 
 def swap_swa_sgd(optimizer):
+    if isinstance(optimizer, WeightAverage):
+        optimizer.swap()
+        return
     for key, value in optimizer.optim_objs.items():
-        value.swap_swa_sgd()
\ No newline at end of file
+        value.swap_swa_sgd()
+
+
+def get_lr(optimizer):
+    """Learning rate of a pyro optimizer or LR scheduler, read from the
+    underlying torch optimizers without serializing their state.
+    Returns ``None`` before the first step has created them."""
+    for value in optimizer.optim_objs.values():
+        value = getattr(value, "optimizer", value)
+        return value.param_groups[0]["lr"]
+    return None
@@ -0,0 +1,396 @@
+import time
+import torch
+import pyro
+import dgl
+from .utils import diffusion_hops, diffusion_tail, prepare_graph
+
+def _reverse(model):
+    # whether the model needs the cached reverse edges
+    return getattr(model, "edge_recover", None) is not None
+
+def _diffusion_time(model):
+    # total time, decay and whether the physique source term is on
+    layers = [getattr(model, f"layer{idx}") for idx in range(model.depth)]
+    t = sum(float(layer.linear_diffusion.t) for layer in layers)
+    gamma = float(layers[0].linear_diffusion.odefunc.gamma)
+    source = bool(layers[0].linear_diffusion.physique)
+    return t, gamma, source
+
+def receptive_field(model, tol=1e-3, max_hops=64):
+    """Number of hops beyond which a node's features change the diffused
+    embeddings of ``model`` by at most ``tol`` (relative)."""
+    t, gamma, source = _diffusion_time(model)
+    return diffusion_hops(t, gamma=gamma, tol=tol, max_hops=max_hops, source=source)
+
+def _local(model, g, h, nodes, hops):
+    # the hops-hop in-subgraph of the nodes, its features and the nodes in it
+    g, inverse = dgl.khop_in_subgraph(g, nodes.to(g.idtype), k=hops)
+    g = prepare_graph(g, reverse=_reverse(model))
+    h = h[g.ndata[dgl.NID].to(h.device).long()]
+    return g, h, inverse.long()
+
+def _sample_edges(model, g, h, num_samples, mask=None):
+    # posterior predictive together with the edge samples it used
+    predictive = pyro.infer.Predictive(
+        model,
+        guide=model.guide,
+        num_samples=num_samples,
+        parallel=True,
+        return_sites=["_RETURN"] + [f"e{idx}" for idx in range(model.depth)],
+    )
+    samples = predictive(g, h, mask=mask)
+    return samples.pop("_RETURN").mean(0), samples
+
+def _predict_restricted(model, g, h, samples, mask=None):
+    # posterior predictive on a subgraph ``g`` (with ``edata[dgl.EID]``)
+    # given the edge samples drawn on its parent graph
+    eids = g.edata[dgl.EID].long()
+    # edges are the third-to-last dimension, followed by heads and the event
+    samples = {
+        key: value.index_select(-3, eids.to(value.device))
+        for key, value in samples.items()
+    }
+    predictive = pyro.infer.Predictive(
+        model,
+        posterior_samples=samples,
+        parallel=True,
+        return_sites=["_RETURN"],
+    )
+    return predictive(g, h, mask=mask)["_RETURN"].mean(0)
+
+@torch.no_grad()
+def predict_nodes(model, g, h, nodes, num_samples=16, hops=None, tol=1e-3):
+    """Posterior predictive of a node classification model for the
+    ``nodes`` only, computed on their ``hops``-hop in-subgraph.
+
+    If ``hops`` is not given it is chosen from ``tol`` with
+    :func:`receptive_field`, so the cost scales with the neighborhood of
+    the queried nodes rather than with the whole graph.
+    """
+    if hops is None:
+        hops = receptive_field(model, tol=tol)
+    model.eval()
+    predictive = pyro.infer.Predictive(
+        model,
+        guide=model.guide,
+        num_samples=num_samples,
+        parallel=True,
+        return_sites=["_RETURN"],
+    )
+    g, h, mask = _local(model, g, h, nodes, hops)
+    return predictive(g, h, mask=mask)["_RETURN"].mean(0)
+
+@torch.no_grad()
+def query_error(model, g, h, nodes, num_samples=16, hops=None, tol=1e-3):
+    """Compare the localized predictions of :func:`predict_nodes` with the
+    full-graph ones.
+
+    Both use the same posterior samples of the edge weights (those of the
+    full graph, restricted to the subgraph), so the difference is the
+    truncation error alone rather than Monte Carlo noise.
+
+    Returns a dict with the number of hops, the a-priori truncation bound,
+    the observed maximum absolute difference of the predicted
+    probabilities and the wall time of both.
+    """
+    if hops is None:
+        hops = receptive_field(model, tol=tol)
+    t, gamma, source = _diffusion_time(model)
+
+    model.eval()
+    time0 = time.time()
+    y_full, samples = _sample_edges(model, g, h, num_samples, mask=nodes)
+    time_full = time.time() - time0
+
+    time0 = time.time()
+    g, h, mask = _local(model, g, h, nodes, hops)
+    y_local = _predict_restricted(model, g, h, samples, mask=mask)
+    time_local = time.time() - time0
+
+    return {
+        "hops": hops,
+        "bound": diffusion_tail(t, gamma=gamma, hops=hops, source=source),
+        "error": float((y_local - y_full).abs().max()),
+        "time_local": time_local,
+        "time_full": time_full,
+    }
+
+class _FixedNoise(pyro.poutine.messenger.Messenger):
+    # draw the logit-normal edge sites ``e{idx}`` as sigmoid(loc + scale *
+    # noise[site]), with the noise shaped (num_samples, edges, heads, 1)
+    def __init__(self, noise):
+        super().__init__()
+        self.noise = noise
+
+    def _pyro_sample(self, msg):
+        if msg["name"] not in self.noise or msg["done"] or msg["is_observed"]:
+            return
+        fn = msg["fn"]
+        shape = fn.batch_shape + fn.event_shape
+        noise = self.noise[msg["name"]]
+        # a single sample outside of the vectorized particles
+        noise = noise[(0,) * max(noise.dim() - len(shape), 0)]
+        while hasattr(fn, "base_dist"):
+            fn = fn.base_dist
+        msg["value"] = torch.sigmoid(
+            torch.addcmul(fn.loc, fn.scale, noise)
+        ).expand(shape)
+        msg["done"] = True
+
+class IncrementalPredictor(object):
+    """Node classification predictions kept up to date under streaming
+    edge and node updates.
+
+    Only the nodes within the (decay-truncated) receptive field of a
+    change are re-predicted, on the subgraph they depend on; predictions
+    elsewhere are kept. The posterior noise of every edge is drawn once
+    and kept in ``g.edata``, so re-predicted nodes whose neighborhood did
+    not change keep their predictions.
+
+    The diffused embeddings of a node beyond ``hops`` of a change differ
+    from the exact ones by at most twice the truncation tail of
+    :func:`~bronx.utils.diffusion_tail` (relative to the features; the
+    readout is not accounted for). This bound accumulates over partial
+    updates and once it exceeds ``staleness`` the whole graph is
+    re-predicted.
+
+    Parameters
+    ----------
+    model : NodeClassificationBronxModel
+    g : DGLGraph
+    h : torch.Tensor
+        Node features.
+    num_samples : int
+        Number of posterior samples per prediction.
+    tol : float
+        Truncation tolerance of the diffusion series.
+    staleness : float
+        Bound on the accumulated error of the cached predictions.
+    """
+    def __init__(self, model, g, h, num_samples=16, tol=1e-3, staleness=1e-2):
+        self.model = model
+        self.g = g
+        self.h = h
+        self.num_samples = num_samples
+        self.tol = tol
+        self.staleness = staleness
+        self.hops = receptive_field(model, tol=tol)
+        t, gamma, source = _diffusion_time(model)
+        # the operators before and after an update contribute a tail each
+        self.bound = 2.0 * diffusion_tail(t, gamma=gamma, hops=self.hops, source=source)
+        self.predictive = pyro.infer.Predictive(
+            model,
+            guide=model.guide,
+            num_samples=num_samples,
+            parallel=True,
+            return_sites=["_RETURN"],
+        )
+        self.g = self.g.local_var()
+        self.g.edata.update(self.noise(self.g.number_of_edges()))
+        self.refresh()
+
+    def noise(self, num_edges):
+        shape = (num_edges, self.num_samples, self.model.layer0.num_heads, 1)
+        return {
+            f"_noise{idx}": torch.randn(shape, device=self.g.device)
+            for idx in range(self.model.depth)
+        }
+
+    def _predict(self, g, h, mask=None):
+        noise = {
+            f"e{idx}": g.edata[f"_noise{idx}"].movedim(0, 1)
+            for idx in range(self.model.depth)
+        }
+        with _FixedNoise(noise):
+            return self.predictive(g, h, mask=mask)["_RETURN"].mean(0)
+
+    @torch.no_grad()
+    def predict(self, nodes=None):
+        self.model.eval()
+        if nodes is None:
+            # updates drop the precomputed formats
+            self.g = prepare_graph(self.g, reverse=_reverse(self.model))
+            return self._predict(self.g, self.h)
+        return self._predict(*_local(self.model, self.g, self.h, nodes, self.hops))
+
+    def refresh(self):
+        self.predictions = self.predict()
+        self.error = 0.0
+
+    def frontier(self, nodes):
+        g, _ = dgl.khop_out_subgraph(self.g, nodes.to(self.g.idtype), k=self.hops)
+        return g.ndata[dgl.NID]
+
+    def update(self, add_edges=None, remove_edges=None, add_nodes=None):
+        """Apply a graph update and re-predict the affected nodes.
+
+        Parameters
+        ----------
+        add_edges : Tuple[torch.Tensor, torch.Tensor], optional
+            Source and destination nodes of the new edges.
+        remove_edges : Tuple[torch.Tensor, torch.Tensor], optional
+            Source and destination nodes of the removed edges.
+        add_nodes : torch.Tensor, optional
+            Features of the new nodes.
+
+        Returns
+        -------
+        torch.Tensor
+            The ids of the nodes that were re-predicted.
+        """
+        affected = []
+        if remove_edges is not None:
+            src, dst = remove_edges[0].to(self.g.idtype), remove_edges[1].to(self.g.idtype)
+            affected.append(self.frontier(dst))
+            self.g = dgl.remove_edges(self.g, self.g.edge_ids(src, dst))
+
+        if add_nodes is not None:
+            idxs = torch.arange(
+                self.g.number_of_nodes(),
+                self.g.number_of_nodes() + add_nodes.shape[0],
+            )
+            self.g = dgl.add_nodes(self.g, add_nodes.shape[0])
+            self.h = torch.cat([self.h, add_nodes.to(self.h)])
+            self.predictions = torch.cat(
+                [
+                    self.predictions,
+                    self.predictions.new_zeros(
+                        add_nodes.shape[0], self.predictions.shape[-1],
+                    ),
+                ]
+            )
+            affected.append(idxs.to(self.g.device))
+
+        if add_edges is not None:
+            src, dst = add_edges[0].to(self.g.idtype), add_edges[1].to(self.g.idtype)
+            self.g = dgl.add_edges(self.g, src, dst, data=self.noise(len(src)))
+            affected.append(self.frontier(dst))
+
+        if len(affected) == 0:
+            return torch.tensor([], dtype=torch.int64)
+
+        self.error += self.bound
+        if self.error > self.staleness:
+            self.refresh()
+            return torch.arange(self.g.number_of_nodes())
+
+        nodes = torch.unique(torch.cat([idxs.long() for idxs in affected]))
+        self.predictions[nodes] = self.predict(nodes)
+        return nodes
+
+@torch.no_grad()
+def edge_scores(model, g, h):
+    """Largest normalized posterior-median weight of every edge of ``g``
+    over the layers and heads of ``model``, i.e. its largest share of the
+    in-flow of its destination in any diffusion operator."""
+    model.eval()
+    trace = pyro.poutine.trace(model.guide).get_trace(g, h)
+    scores = None
+    for idx in range(model.depth):
+        fn = trace.nodes[f"e{idx}"]["fn"]
+        while hasattr(fn, "base_dist"):
+            fn = fn.base_dist
+        e = torch.sigmoid(fn.loc).flatten(1)
+        e = e / dgl.ops.copy_e_sum(g, e)[g.edges()[1].long()]
+        score = e.max(-1)[0]
+        scores = score if scores is None else torch.maximum(scores, score)
+    return scores
+
+@torch.no_grad()
+def sparsify(model, g, h, threshold=None, k=None):
+    """Compact copy of ``g`` for inference, keeping the edges whose
+    normalized weight (see :func:`edge_scores`) is at least ``threshold``
+    and / or the ``k`` strongest in-edges of every node.
+
+    The original edge ids are kept in ``edata[dgl.EID]``."""
+    scores = edge_scores(model, g, h)
+    keep = torch.ones_like(scores, dtype=torch.bool)
+    if threshold is not None:
+        keep = keep & (scores >= threshold)
+    if k is not None:
+        topk = torch.zeros_like(keep)
+        g_score = dgl.graph(g.edges(), num_nodes=g.number_of_nodes())
+        g_score.edata["score"] = scores
+        topk[dgl.sampling.select_topk(g_score, k, "score").edata[dgl.EID].long()] = True
+        keep = keep & topk
+    return dgl.edge_subgraph(
+        g, torch.where(keep)[0].to(g.idtype), relabel_nodes=False,
+    )
+
+class SparsePredictor(object):
+    """Node classification predictions on a sparsified graph.
+
+    The compact graph is built once from the posterior of ``model`` (see
+    :func:`sparsify`) and reused by every prediction, so inference scales
+    with the number of effective edges.
+
+    Parameters
+    ----------
+    model : NodeClassificationBronxModel
+    g : DGLGraph
+    h : torch.Tensor
+        Node features.
+    threshold : float, optional
+        Minimum normalized edge weight.
+    k : int, optional
+        Maximum number of in-edges per node.
+    num_samples : int
+        Number of posterior samples per prediction.
+    """
+    def __init__(self, model, g, h, threshold=None, k=None, num_samples=16):
+        self.model = model
+        self.g = g
+        self.h = h
+        self.num_samples = num_samples
+        self.g_sparse = prepare_graph(
+            sparsify(model, g, h, threshold=threshold, k=k),
+            reverse=_reverse(model),
+        )
+        self.predictive = pyro.infer.Predictive(
+            model,
+            guide=model.guide,
+            num_samples=num_samples,
+            parallel=True,
+            return_sites=["_RETURN"],
+        )
+
+    @torch.no_grad()
+    def predict(self, mask=None, sparse=True):
+        self.model.eval()
+        g = self.g_sparse if sparse else self.g
+        return self.predictive(g, self.h, mask=mask)["_RETURN"].mean(0)
+
+    @torch.no_grad()
+    def compare(self, mask=None, y=None):
+        """Predictions on the sparse graph against the full graph: the
+        fraction of edges kept, the maximum absolute difference of the
+        probabilities, the agreement of the predicted classes, the
+        accuracies if labels ``y`` are given, and the wall times.
+
+        Both predictions use the same posterior samples of the kept edges,
+        so the difference is due to the dropped edges alone."""
+        self.model.eval()
+        time0 = time.time()
+        y_full, samples = _sample_edges(
+            self.model, self.g, self.h, self.num_samples, mask=mask,
+        )
+        time_full = time.time() - time0
+        time0 = time.time()
+        y_sparse = _predict_restricted(
+            self.model, self.g_sparse, self.h, samples, mask=mask,
+        )
+        time_sparse = time.time() - time0
+
+        report = {
+            "edges": self.g.number_of_edges(),
+            "edges_kept": self.g_sparse.number_of_edges(),
+            "fraction": self.g_sparse.number_of_edges() / max(self.g.number_of_edges(), 1),
+            "error": float((y_sparse - y_full).abs().max()),
+            "agreement": float((y_sparse.argmax(-1) == y_full.argmax(-1)).float().mean()),
+            "time_sparse": time_sparse,
+            "time_full": time_full,
+        }
+        if y is not None:
+            report["accuracy_sparse"] = float((y_sparse.argmax(-1) == y).float().mean())
+            report["accuracy_full"] = float((y_full.argmax(-1) == y).float().mean())
+        return report
@@ -0,0 +1,137 @@
+import weakref
+import resource
+from collections import defaultdict
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+_TAGS = []
+
+class tag(object):
+    """Attribute the allocations made inside the block to ``name``
+    (nested tags are joined with ``/``). Costs a list append / pop when
+    no :class:`MemoryProfiler` is active."""
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _TAGS.append(self.name)
+
+    def __exit__(self, *args):
+        _TAGS.pop()
+
+def current_tag():
+    node = getattr(torch._C, "_current_autograd_node", lambda: None)()
+    if node is not None:
+        return "backward/" + node.name()
+    if len(_TAGS) == 0:
+        return "untagged"
+    return "/".join(_TAGS)
+
+def peak_rss():
+    """Peak resident set size of the process in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def peak_memory(reset=False):
+    """Peak allocated GPU memory in bytes (since the last ``reset``) if
+    CUDA is available, else the peak RSS of the process, which cannot be
+    reset."""
+    if torch.cuda.is_available():
+        if reset:
+            torch.cuda.reset_peak_memory_stats()
+        return torch.cuda.max_memory_allocated()
+    return peak_rss()
+
+class MemoryProfiler(TorchDispatchMode):
+    """Tracks the memory of the tensors created while it is active, by
+    :class:`tag`.
+
+    Every new storage is attributed to the tag active when an op created
+    it and counted as live until the tensor that created it is collected
+    (views outliving it are not accounted for). For every tag, ``report``
+    gives the bytes ``allocated`` in total, the ``peak`` of its live
+    bytes, and the bytes still ``retained``, plus the overall peak.
+
+    Examples
+    --------
+    >>> with MemoryProfiler() as profiler:
+    ...     svi.step(g, h, y=y)
+    >>> profiler.report()
+    """
+    def __init__(self):
+        super().__init__()
+        self.storages = {}
+        self.external = set()
+        self.live = defaultdict(int)
+        self.peak = defaultdict(int)
+        self.allocated = defaultdict(int)
+        self.total = 0
+        self.peak_total = 0
+        self.peak_tags = {}
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        # views of tensors created before profiling are not allocations;
+        # forget them with their storage, whose address may be reused
+        for tensor in tree_flatten((args, kwargs))[0]:
+            if isinstance(tensor, torch.Tensor) and tensor.device.type != "meta":
+                storage = tensor.untyped_storage()
+                key = (tensor.device, storage.data_ptr())
+                if key not in self.storages and key not in self.external:
+                    self.external.add(key)
+                    weakref.finalize(storage, self.external.discard, key)
+        name = None
+        for tensor in tree_flatten(out)[0]:
+            if not isinstance(tensor, torch.Tensor) or tensor.device.type == "meta":
+                continue
+            storage = tensor.untyped_storage()
+            key = (tensor.device, storage.data_ptr())
+            if key in self.storages or key in self.external or storage.nbytes() == 0:
+                continue
+            if name is None:
+                name = current_tag()
+            self._alloc(key, name, storage.nbytes())
+            weakref.finalize(tensor, self._free, key)
+        return out
+
+    def _alloc(self, key, name, nbytes):
+        self.storages[key] = (name, nbytes)
+        self.allocated[name] += nbytes
+        self.live[name] += nbytes
+        self.peak[name] = max(self.peak[name], self.live[name])
+        self.total += nbytes
+        if self.total > self.peak_total:
+            self.peak_total = self.total
+            self.peak_tags = {
+                name: nbytes for name, nbytes in self.live.items() if nbytes > 0
+            }
+
+    def _free(self, key):
+        name, nbytes = self.storages.pop(key, (None, 0))
+        if name is not None:
+            self.live[name] -= nbytes
+            self.total -= nbytes
+
+    def report(self):
+        return {
+            "peak": self.peak_total,
+            "retained": self.total,
+            "peak_rss": peak_rss(),
+            # live bytes per tag when the overall peak was reached
+            "at_peak": dict(self.peak_tags),
+            "tags": {
+                name: {
+                    "allocated": self.allocated[name],
+                    "peak": self.peak[name],
+                    "retained": self.live[name],
+                }
+                for name in sorted(self.allocated)
+            },
+        }
+
+def profile_memory(fn, *args, **kwargs):
+    """Call ``fn`` under a :class:`MemoryProfiler` and return its result
+    and the memory report."""
+    with MemoryProfiler() as profiler:
+        result = fn(*args, **kwargs)
+    return result, profiler.report()
@@ -0,0 +1,159 @@
+import math
+import torch
+import dgl
+
+def _sample(cdf, low, high, generator):
+    # inverse-CDF sampling of node ids with cdf[low] <= u < cdf[high]
+    u = torch.rand(low.shape, generator=generator, dtype=cdf.dtype)
+    u = low + u * (high - low)
+    return torch.searchsorted(cdf, u, right=True).clamp(max=len(cdf) - 1)
+
+def node_classification_graph(
+        num_nodes,
+        avg_degree=10,
+        num_classes=4,
+        num_features=32,
+        homophily=0.8,
+        exponent=2.5,
+        signal=1.0,
+        split=(0.1, 0.1),
+        seed=0,
+        chunk_size=1 << 24,
+    ):
+    """Degree-corrected stochastic block model graph with power-law
+    expected degrees, Gaussian class-conditional features and labels.
+
+    Nodes are assigned to ``num_classes`` contiguous blocks; every edge
+    draws its source with probability proportional to its weight
+    ``(i + 1) ** (-1 / (exponent - 1))`` and its destination from the same
+    block with probability ``homophily`` (otherwise from the whole graph).
+    Edges are drawn in chunks of ``chunk_size``, so graphs with 10^8
+    edges fit in memory.
+
+    Returns
+    -------
+    DGLGraph
+        With ``feat``, ``label`` and ``train_mask`` / ``val_mask`` /
+        ``test_mask`` node data (``split`` are the train / val fractions).
+    """
+    generator = torch.Generator().manual_seed(seed)
+    num_edges = int(num_nodes * avg_degree)
+
+    # shuffled so that the hubs are spread over the blocks
+    weight = torch.arange(1, num_nodes + 1, dtype=torch.float64)
+    if exponent is not None:
+        weight = weight ** (-1.0 / (exponent - 1.0))
+    else:
+        weight = torch.ones_like(weight)
+    weight = weight[torch.randperm(num_nodes, generator=generator)]
+    cdf = torch.cumsum(weight, 0)
+    cdf = cdf / cdf[-1]
+    cdf0 = torch.cat([cdf.new_zeros(1), cdf])
+
+    label = torch.arange(num_nodes) * num_classes // num_nodes
+    block = (torch.arange(num_classes + 1) * num_nodes + num_classes - 1) // num_classes
+
+    src, dst = [], []
+    for start in range(0, num_edges, chunk_size):
+        size = min(chunk_size, num_edges - start)
+        zeros, ones = cdf.new_zeros(size), cdf.new_ones(size)
+        _src = _sample(cdf, zeros, ones, generator)
+        same = torch.rand(size, generator=generator) < homophily
+        c = label[_src]
+        low = torch.where(same, cdf0[block[c]], zeros)
+        high = torch.where(same, cdf0[block[c + 1]], ones)
+        _dst = _sample(cdf, low, high, generator)
+        src.append(_src.int())
+        dst.append(_dst.int())
+
+    g = dgl.graph(
+        (torch.cat(src), torch.cat(dst)), num_nodes=num_nodes, idtype=torch.int32,
+    )
+
+    centroid = torch.randn(num_classes, num_features, generator=generator)
+    g.ndata["feat"] = signal * centroid[label] + torch.randn(
+        num_nodes, num_features, generator=generator,
+    )
+    g.ndata["label"] = label
+
+    idxs = torch.randperm(num_nodes, generator=generator)
+    num_train, num_val = int(split[0] * num_nodes), int(split[1] * num_nodes)
+    for name, _idxs in [
+        ("train_mask", idxs[:num_train]),
+        ("val_mask", idxs[num_train:num_train + num_val]),
+        ("test_mask", idxs[num_train + num_val:]),
+    ]:
+        mask = torch.zeros(num_nodes, dtype=torch.bool)
+        mask[_idxs] = True
+        g.ndata[name] = mask
+    return g
+
+def molecule_batch(
+        num_graphs,
+        min_nodes=10,
+        max_nodes=40,
+        num_features=32,
+        ring_rate=1.0,
+        noise=0.1,
+        seed=0,
+    ):
+    """Batch of random molecule-like graphs for graph regression.
+
+    Every graph is a random tree over ``min_nodes`` to ``max_nodes`` nodes
+    with, on average, ``ring_rate`` extra bonds closing rings; all bonds
+    are bidirected. Node features ``h0`` are one-hot "atom types" and the
+    target is a fixed linear function of the summed features plus the
+    number of rings and Gaussian noise.
+
+    Returns
+    -------
+    DGLGraph
+        The batched graph.
+    torch.Tensor
+        Targets of shape ``(num_graphs, 1)``.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    num_nodes = torch.randint(
+        min_nodes, max_nodes + 1, (num_graphs,), generator=generator,
+    )
+    offset = torch.cumsum(num_nodes, 0) - num_nodes
+    graph = torch.repeat_interleave(torch.arange(num_graphs), num_nodes)
+    local = torch.arange(len(graph)) - offset[graph]
+
+    # each node but the first of its graph bonds to an earlier one
+    child = torch.where(local > 0)[0]
+    parent = offset[graph[child]] + (
+        torch.rand(len(child), generator=generator) * local[child]
+    ).long()
+
+    num_rings = torch.poisson(
+        torch.full((num_graphs,), float(ring_rate)), generator=generator,
+    ).long()
+    ring_graph = torch.repeat_interleave(torch.arange(num_graphs), num_rings)
+    ring_src = offset[ring_graph] + (
+        torch.rand(len(ring_graph), generator=generator) * num_nodes[ring_graph]
+    ).long()
+    ring_dst = offset[ring_graph] + (
+        torch.rand(len(ring_graph), generator=generator) * num_nodes[ring_graph]
+    ).long()
+    keep = ring_src != ring_dst
+    ring_src, ring_dst = ring_src[keep], ring_dst[keep]
+    num_rings = torch.bincount(ring_graph[keep], minlength=num_graphs)
+
+    src = torch.cat([child, parent, ring_src, ring_dst])
+    dst = torch.cat([parent, child, ring_dst, ring_src])
+    order = torch.argsort(graph[src], stable=True)
+    src, dst = src[order], dst[order]
+
+    g = dgl.graph((src, dst), num_nodes=len(graph))
+    g.set_batch_num_nodes(num_nodes)
+    g.set_batch_num_edges(torch.bincount(graph[src], minlength=num_graphs))
+
+    atom = torch.randint(num_features, (len(graph),), generator=generator)
+    h0 = torch.nn.functional.one_hot(atom, num_features).float()
+    g.ndata["h0"] = h0
+
+    coefficient = torch.randn(num_features, generator=generator) / math.sqrt(max_nodes)
+    y = torch.zeros(num_graphs).index_add_(0, graph, h0 @ coefficient)
+    y = y + num_rings + noise * torch.randn(num_graphs, generator=generator)
+    return g, y.unsqueeze(-1)
@@ -0,0 +1,33 @@
+import torch
+import dgl
+
+
+def test_coarsen_hierarchy():
+    from bronx.coarsen import coarsen_hierarchy
+
+    g = dgl.rand_graph(100, 1000)
+    hierarchy = coarsen_hierarchy(g, 2)
+    assert len(hierarchy) > 0 and coarsen_hierarchy(g.local_var(), 2) is hierarchy
+    level = hierarchy[0]
+    assert level.size.max() <= 2 and level.size.sum() == 100
+
+    # in-normalized weights stay in-normalized on the coarse graph
+    e = torch.rand(g.number_of_edges(), 4, 1)
+    e = e / dgl.ops.copy_e_sum(g, e)[g.edges()[1].long()]
+    e_coarse = level.restrict_edges(e)
+    in_sum = dgl.ops.copy_e_sum(level.g, e_coarse)
+    has_in = level.g.in_degrees() > 0
+    assert torch.allclose(in_sum[has_in], torch.ones_like(in_sum[has_in]), atol=1e-5)
+
+
+def test_multilevel_diffusion():
+    from bronx.layers import LinearDiffusion
+
+    g = dgl.rand_graph(100, 1000)
+    h = torch.randn(100, 8)
+    e = torch.rand(g.number_of_edges(), 2, 1)
+    diffusion = LinearDiffusion(1.0, levels=2, fine_fraction=0.2)
+    assert diffusion(g, h, e).shape == h.shape
+    assert 0.0 < diffusion.multilevel_error(g, h, e) < 1.0
+    diffusion.fine_fraction = 1.0
+    assert diffusion.multilevel_error(g, h, e) == 0.0
@@ -0,0 +1,51 @@
+import torch
+
+
+def test_bucket_batch_sampler():
+    from bronx.data import BucketBatchSampler
+
+    keys = torch.tensor([5.0, 1.0, 4.0, 2.0, 3.0, 0.0])
+    sampler = BucketBatchSampler(keys, batch_size=2)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 3
+    assert sorted(sum(batches, [])) == list(range(6))
+    for batch in batches:
+        assert abs(keys[batch[0]] - keys[batch[1]]) == 1.0
+
+
+def test_bucket_batch_sampler_large_keys():
+    from bronx.data import BucketBatchSampler
+
+    # e.g. "degree" keys, beyond the integers exact in float32
+    keys = (1 << 30) + torch.tensor([5, 1, 4, 2, 3, 0])
+    sampler = BucketBatchSampler(keys, batch_size=2)
+    for batch in sampler:
+        assert abs(int(keys[batch[0]]) - int(keys[batch[1]])) == 1
+
+
+def test_bucket_batch_sampler_empty():
+    from bronx.data import BucketBatchSampler
+
+    sampler = BucketBatchSampler(torch.tensor([], dtype=torch.long), batch_size=2, drop_last=True)
+    assert list(sampler) == [] and len(sampler) == 0
+
+
+def test_graph_keys_unknown():
+    import pytest
+    from bronx.data import graph_keys
+
+    with pytest.raises(ValueError):
+        graph_keys([], by="volume")
+
+
+def test_nfe_batch_sampler():
+    from bronx.data import NFEBatchSampler
+
+    keys = torch.tensor([3, 0, 2, 1, 5, 4])
+    sampler = NFEBatchSampler(keys, batch_size=2, shuffle=False)
+    batches = list(sampler)
+    assert [sorted(keys[batch].tolist()) for batch in batches] == [[0, 1], [2, 3], [4, 5]]
+    for idx, batch in enumerate(batches):
+        sampler.record(idx, 10 * (idx + 1))
+    assert not torch.isnan(sampler.nfe).any()
+    assert [sorted(batch) for batch in sampler] == [sorted(batch) for batch in batches]
@@ -0,0 +1,25 @@
+import torch
+import pyro
+
+
+def test_logit_normal():
+    from bronx.distributions import LogitNormal
+
+    loc, scale = torch.randn(5, 3), torch.rand(5, 3) + 0.1
+    reference = pyro.distributions.TransformedDistribution(
+        pyro.distributions.Normal(loc, scale),
+        pyro.distributions.transforms.SigmoidTransform(),
+    )
+    distribution = LogitNormal(loc, scale)
+    value = torch.rand(5, 3)
+    assert torch.allclose(distribution.log_prob(value), reference.log_prob(value), atol=1e-4)
+    value = distribution.rsample()
+    assert torch.allclose(distribution.log_prob(value), reference.log_prob(value), atol=1e-4)
+
+    other = LogitNormal(torch.zeros(5, 3), torch.ones(5, 3))
+    kl = torch.distributions.kl_divergence(distribution.to_event(2), other.to_event(2))
+    assert torch.allclose(
+        kl, torch.distributions.kl_divergence(
+            torch.distributions.Normal(loc, scale), torch.distributions.Normal(0.0, 1.0),
+        ).sum(),
+    )
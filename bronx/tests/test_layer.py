@@ -5,8 +5,63 @@ import dgl
 def test_multihead():
     g = dgl.rand_graph(3, 5)
     h = torch.rand(3, 10)
-    e = torch.rand(5, 1)
-    from bronx.layers import linear_diffusion
+    e = torch.rand(5, 2, 1)
+    from bronx.layers import LinearDiffusion
 
-    a = linear_diffusion(g, h, e=e)
-    print(a.shape)
+    a = LinearDiffusion(t=1.0)(g, h, e)
+    assert a.shape == h.shape
+
+
+def test_neighborhood_recover_log_prob():
+    import pyro
+    from bronx.layers import NeighborhoodRecover
+
+    g = dgl.rand_graph(6, 10)
+    layer = NeighborhoodRecover(4)
+    with torch.no_grad():
+        layer.fc_mu.weight.copy_(torch.eye(4) + 1e-2 * torch.randn(4, 4))
+        layer.fc_log_sigma.weight.mul_(1e-3)
+    # large features with a nearby mean, where an expanded square cancels
+    for h in torch.randn(6, 4), 1e3 + torch.randn(6, 4):
+        trace = pyro.poutine.trace(layer).get_trace(g, h)
+        log_prob = trace.nodes["neighborhood_recover"]["fn"].log_prob(
+            trace.nodes["neighborhood_recover"]["value"]
+        )
+
+        src, dst = dgl.add_reverse_edges(g).edges()
+        expected = torch.distributions.Normal(
+            layer.fc_mu(h)[src], layer.fc_log_sigma(h)[src].exp(),
+        ).log_prob(h[dst]).sum(-1)
+        assert torch.allclose(log_prob, expected, rtol=1e-4, atol=1e-3)
+
+
+def test_memory_profiler_tags():
+    from bronx.profiling import MemoryProfiler
+    from bronx.layers import BronxLayer
+
+    g = dgl.rand_graph(6, 10)
+    h = torch.randn(6, 8)
+    layer = BronxLayer(8, 8, num_heads=2)
+    with MemoryProfiler() as profiler:
+        layer.guide(g, h)
+    report = profiler.report()
+    assert report["peak"] > 0
+    assert "diffusion" in report["tags"] and "sample" in report["tags"]
+
+
+def test_memory_profiler_reused_storage():
+    from bronx.profiling import MemoryProfiler, tag
+
+    # large enough to be mmap-ed, so that its address is handed out again
+    x = torch.empty(1 << 24)
+    with MemoryProfiler() as profiler:
+        x.zero_()  # a storage from before profiling
+        address = x.data_ptr()
+        del x
+        with tag("new"):
+            # allocate until the allocator hands out the freed address
+            ys = [torch.empty(1 << 24)]
+            while ys[-1].data_ptr() != address and len(ys) < 4:
+                ys.append(torch.empty(1 << 24))
+    nbytes = ys[0].untyped_storage().nbytes()
+    assert profiler.report()["tags"]["new"]["allocated"] == len(ys) * nbytes
@@ -7,6 +7,113 @@ def test_dimension():
 
     g = dgl.rand_graph(5, 8)
     h0 = torch.zeros(5, 16)
-    layer = BronxModel(16, 32, 32, 2)
-    h = layer.model(g, h0)
+    layer = BronxModel(16, 32, 32, 2, num_heads=2)
+    h = layer(g, h0)
+    assert h.shape == (5, 32)
     layer.guide(g, h0)
+
+
+def test_streamed_projection():
+    import numpy as np
+    from bronx.models import BronxModel
+
+    h0 = np.random.randn(10, 16).astype(np.float32)
+    model = BronxModel(16, 32, 2, chunk_size=3)
+    h = model.project(h0)
+    h_ref = model.fc_in(torch.from_numpy(h0))
+    assert torch.allclose(h, h_ref, atol=1e-5)
+    h.sum().backward()
+    grad = model.fc_in[0].weight.grad.clone()
+    model.fc_in[0].weight.grad = None
+    h_ref.sum().backward()
+    assert torch.allclose(grad, model.fc_in[0].weight.grad, atol=1e-5)
+
+
+def test_stacked_model():
+    import pyro
+    from bronx.models import StackedNodeClassificationBronxModel
+
+    g = dgl.rand_graph(6, 12)
+    h0 = torch.randn(6, 8)
+    y = torch.randint(3, (6,))
+    for node_prior in (False, True):
+        model = StackedNodeClassificationBronxModel(
+            num_stacks=3, in_features=8, hidden_features=8, out_features=3,
+            num_heads=2, kl_scale=[1.0, 0.1, 0.01], sigma_factor=[1.0, 2.0, 3.0],
+            node_prior=node_prior, norm=node_prior, depth=2,
+        )
+        elbo = pyro.infer.TraceMeanField_ELBO(num_particles=2, vectorize_particles=True)
+        loss = elbo.differentiable_loss(model, model.guide, g, h0, y=y)
+        loss.backward()
+        assert model.fc_in.weight_2.grad is not None
+        if node_prior:
+            assert model.layer1.fc_mu_prior.weight_2.grad is not None
+        assert model(g, h0).shape == (3, 6, 3)
+
+
+def test_fused_diffusion():
+    import pyro
+    from bronx.models import BronxModel
+
+    g = dgl.rand_graph(5, 8)
+    h0 = torch.randn(5, 16)
+    model = BronxModel(16, 8, 4, num_heads=2, depth=3, fused=True)
+    guide_trace = pyro.poutine.trace(model.guide).get_trace(g, h0)
+    assert {"e0", "e1", "e2"} <= set(guide_trace.nodes)
+    h = pyro.poutine.replay(model, trace=guide_trace)(g, h0)
+    assert h.shape == (5, 4)
+    assert model.nfe > 0
+
+
+def test_prepared_graph():
+    import pytest
+    from bronx import utils
+    from bronx.models import BronxModel
+
+    g = dgl.rand_graph(5, 8)
+    h0 = torch.randn(5, 16)
+    model = BronxModel(16, 8, 4, num_heads=2, edge_recover=1.0)
+    with pytest.raises(ValueError):
+        utils.check_prepared(g)
+    g_prepared = utils.prepare_graph(g)
+    assert g_prepared.idtype == torch.int32
+    utils.check_prepared(g_prepared.local_var(), reverse=True)
+
+    utils.set_benchmark(True)
+    try:
+        with pytest.raises(ValueError):
+            model(g, h0)
+        assert model(g_prepared, h0).shape == (5, 4)
+    finally:
+        utils.set_benchmark(False)
+
+
+def test_fused_matches_sequential():
+    import pytest
+    import pyro
+    from bronx.models import BronxModel
+
+    g = dgl.rand_graph(5, 8)
+    h0 = torch.randn(5, 16)
+    # the edge priors do not depend on the features, so with the same edge
+    # samples the fused solve integrates the same equation as the layers
+    model = BronxModel(16, 8, 4, num_heads=2, depth=2, fused=True)
+    guide_trace = pyro.poutine.trace(model.guide).get_trace(g, h0)
+    model_trace = pyro.poutine.trace(
+        pyro.poutine.replay(model, trace=guide_trace)
+    ).get_trace(g, h0)
+    h_fused = model_trace.nodes["_RETURN"]["value"]
+    model.fused = False
+    h = pyro.poutine.replay(model, trace=model_trace)(g, h0)
+    assert torch.allclose(h, h_fused, atol=1e-5)
+
+    with pytest.raises(ValueError):
+        BronxModel(16, 8, 4, num_heads=2, depth=2, fused=True, physique=True)
+
+
+def test_fused_rejects_multilevel():
+    import pytest
+    from bronx.models import BronxModel
+
+    with pytest.raises(ValueError):
+        BronxModel(16, 8, 4, num_heads=2, fused=True, multilevel=1)
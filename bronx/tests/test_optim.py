@@ -0,0 +1,15 @@
+import torch
+
+
+def test_weight_average():
+    from bronx.optim import WeightAverage
+
+    params = [torch.zeros(3), torch.zeros(2, 2)]
+    average = WeightAverage(params)
+    for value in [1.0, 2.0, 3.0]:
+        for param in params:
+            param.fill_(value)
+        average.update()
+    with average.averaged():
+        assert all((param == 2.0).all() for param in params)
+    assert all((param == 3.0).all() for param in params)
@@ -0,0 +1,85 @@
+import torch
+import dgl
+
+
+def test_diffusion_hops():
+    from bronx.utils import diffusion_hops
+
+    assert diffusion_hops(1.0, tol=1e-2) < diffusion_hops(1.0, tol=1e-4)
+    assert diffusion_hops(1.0, tol=1e-3) < diffusion_hops(5.0, tol=1e-3)
+    assert diffusion_hops(5.0, tol=1e-3) < diffusion_hops(5.0, tol=1e-3, source=True)
+
+
+def test_incremental_predictor():
+    from bronx.models import NodeClassificationBronxModel
+    from bronx.predict import IncrementalPredictor
+
+    g = dgl.rand_graph(20, 60)
+    h = torch.randn(20, 8)
+    model = NodeClassificationBronxModel(
+        in_features=8, hidden_features=8, out_features=3, num_heads=2,
+    )
+    predictor = IncrementalPredictor(model, g, h, num_samples=2, staleness=1.0)
+    nodes = predictor.update(
+        add_edges=(torch.tensor([0]), torch.tensor([1])),
+        add_nodes=torch.randn(2, 8),
+    )
+    assert predictor.predictions.shape == (22, 3)
+    assert 1 in nodes.tolist() and 21 in nodes.tolist()
+    # the posterior noise is fixed, so re-predicting changes nothing
+    assert torch.equal(predictor.predict(nodes), predictor.predictions[nodes])
+    assert predictor.error == predictor.bound > 0
+
+
+def test_predict_nodes():
+    from bronx.models import NodeClassificationBronxModel
+    from bronx.predict import predict_nodes, query_error
+
+    g = dgl.rand_graph(20, 60)
+    h = torch.randn(20, 8)
+    model = NodeClassificationBronxModel(
+        in_features=8, hidden_features=8, out_features=3, num_heads=2,
+    )
+    nodes = torch.tensor([0, 5])
+    y_hat = predict_nodes(model, g, h, nodes, num_samples=2)
+    assert y_hat.shape == (2, 3)
+    report = query_error(model, g, h, nodes, num_samples=2, hops=1)
+    assert report["hops"] == 1 and report["bound"] > 0
+
+
+def test_query_error_truncation():
+    from bronx.models import NodeClassificationBronxModel
+    from bronx.predict import query_error, receptive_field
+
+    # a ring, so that the receptive field is a strict subset of the graph
+    src = torch.arange(100)
+    dst = (src + 1) % 100
+    g = dgl.graph((torch.cat([src, dst]), torch.cat([dst, src])))
+    h = torch.randn(100, 8)
+    nodes = torch.tensor([0, 50])
+    for physique in (False, True):
+        model = NodeClassificationBronxModel(
+            in_features=8, hidden_features=8, out_features=3, num_heads=2,
+            physique=physique,
+        )
+        hops = receptive_field(model, tol=1e-6)
+        assert 2 * (2 * hops + 1) < g.number_of_nodes()
+        # with the same posterior samples only the truncation error remains
+        coarse = query_error(model, g, h, nodes, num_samples=2, hops=1)
+        fine = query_error(model, g, h, nodes, num_samples=2, hops=hops)
+        assert fine["bound"] <= 1e-6 < coarse["bound"]
+        assert fine["error"] < 1e-5 < coarse["error"]
+
+
+def test_sparsify():
+    from bronx.models import NodeClassificationBronxModel
+    from bronx.predict import sparsify, SparsePredictor
+
+    g = dgl.rand_graph(8, 30)
+    h = torch.randn(8, 4)
+    model = NodeClassificationBronxModel(4, 8, 3, num_heads=2, depth=2)
+    g_sparse = sparsify(model, g, h, k=2)
+    assert g_sparse.number_of_nodes() == 8
+    assert int(g_sparse.in_degrees().max()) <= 2
+    report = SparsePredictor(model, g, h, threshold=0.0, num_samples=2).compare()
+    assert report["edges_kept"] == 30
@@ -0,0 +1,21 @@
+import dgl
+
+
+def test_node_classification_graph():
+    from bronx.synthetic import node_classification_graph
+
+    g = node_classification_graph(1000, avg_degree=5, num_classes=4, homophily=1.0, chunk_size=1024)
+    assert g.number_of_edges() == 5000
+    src, dst = g.edges()
+    label = g.ndata["label"]
+    assert (label[src.long()] == label[dst.long()]).all()
+    assert int(g.ndata["train_mask"].sum() + g.ndata["val_mask"].sum() + g.ndata["test_mask"].sum()) == 1000
+
+
+def test_molecule_batch():
+    from bronx.synthetic import molecule_batch
+
+    g, y = molecule_batch(8, min_nodes=3, max_nodes=6)
+    assert g.batch_size == 8 and y.shape == (8, 1)
+    for graph in dgl.unbatch(g):
+        assert graph.number_of_edges() >= 2 * (graph.number_of_nodes() - 1)
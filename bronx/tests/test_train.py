@@ -0,0 +1,32 @@
+def test_trainer_eval_every():
+    from bronx.train import Trainer
+
+    evaluated = []
+    def evaluate():
+        evaluated.append(len(evaluated))
+        return {"accuracy": -len(evaluated)}
+
+    trainer = Trainer(lambda epoch: 0.0, evaluate=evaluate, eval_every=3)
+    metrics = list(trainer.run(7))
+    assert len(metrics) == 7
+    assert [m["epoch"] for m in metrics if "accuracy" in m] == [2, 5, 6]
+    assert trainer.best == -1
+
+
+def test_telemetry(tmp_path):
+    import json
+    from bronx.train import Trainer, Telemetry
+
+    def checkpoint(trainer, metrics):
+        pass
+
+    path = str(tmp_path / "telemetry.jsonl")
+    telemetry = Telemetry(path, data="test")
+    trainer = Trainer(lambda epoch: 0.0, evaluate=lambda: {"accuracy": 1.0}, hooks=[checkpoint])
+    for metrics in trainer.run(2):
+        telemetry(metrics)
+    telemetry.close()
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 2 and records[0]["data"] == "test"
+    assert {"time_step", "time_eval", "time_checkpoint", "peak_memory"} <= set(records[0])
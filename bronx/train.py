@@ -0,0 +1,155 @@
+import time
+import json
+from .optim import get_lr
+from .profiling import peak_memory
+
+class Trainer(object):
+    """Epoch loop around an SVI step shared by the training scripts.
+
+    Parameters
+    ----------
+    step : Callable[[int], float]
+        Runs the SVI steps of one epoch and returns the loss.
+    evaluate : Callable[[], dict], optional
+        Returns the validation metrics, including ``metric``.
+    scheduler : pyro.optim.PyroOptim, optional
+        Stepped with ``metric`` after every evaluation.
+    metric : str
+        Validation metric tracking the best epoch.
+    mode : str
+        ``"max"`` or ``"min"``.
+    eval_every : int
+        Evaluate every ``eval_every`` epochs ...
+    eval_time : float
+        ... or once ``eval_time`` seconds have passed since the last
+        evaluation, whichever comes first. The last epoch is always
+        evaluated.
+    min_lr : float
+        Stop once the learning rate drops below it.
+    hooks : list of Callable[[Trainer, dict], None]
+        Called with the metrics after every epoch, e.g. for checkpointing.
+    model : BronxModel, optional
+        If given, the solver NFE of the step and the evaluation are
+        reported as ``nfe_step`` and ``nfe_eval``.
+
+    Besides the loss and the validation metrics, every epoch reports the
+    learning rate, the wall time of the step, evaluation, scheduler and
+    each hook (``time_<hook name>``) and the peak memory.
+    """
+    def __init__(
+            self,
+            step,
+            evaluate=None,
+            scheduler=None,
+            metric="accuracy",
+            mode="max",
+            eval_every=1,
+            eval_time=0.0,
+            min_lr=0.0,
+            hooks=(),
+            model=None,
+    ):
+        self.step = step
+        self.evaluate = evaluate
+        self.scheduler = scheduler
+        self.metric = metric
+        self.mode = mode
+        self.eval_every = max(eval_every, 1)
+        self.eval_time = eval_time
+        self.min_lr = min_lr
+        self.hooks = list(hooks)
+        self.model = model
+        self.best = None
+        self.best_metrics = {}
+
+    def is_better(self, value):
+        if self.best is None:
+            return True
+        if self.mode == "max":
+            return value > self.best
+        return value < self.best
+
+    def should_evaluate(self, epoch, n_epochs, time_last_eval):
+        if self.evaluate is None:
+            return False
+        if epoch == n_epochs - 1 or (epoch + 1) % self.eval_every == 0:
+            return True
+        return self.eval_time > 0 and time.time() - time_last_eval >= self.eval_time
+
+    def reset_nfe(self):
+        if self.model is not None:
+            self.model.reset_nfe()
+
+    def nfe(self):
+        return self.model.nfe if self.model is not None else None
+
+    def run(self, n_epochs, start_epoch=0):
+        """Train from ``start_epoch`` to ``n_epochs`` and yield the metrics
+        of every epoch."""
+        time_last_eval = time.time()
+        for epoch in range(start_epoch, n_epochs):
+            peak_memory(reset=True)
+            time0 = time.time()
+            self.reset_nfe()
+            loss = self.step(epoch)
+            time_step = time.time() - time0
+            metrics = {
+                "epoch": epoch, "loss": loss, "time_step": time_step, 
+                "nfe_step": self.nfe(),
+            }
+
+            if self.should_evaluate(epoch, n_epochs, time_last_eval):
+                time1 = time.time()
+                self.reset_nfe()
+                metrics.update(self.evaluate())
+                metrics["nfe_eval"] = self.nfe()
+                value = metrics[self.metric]
+                metrics["improved"] = self.is_better(value)
+                if metrics["improved"]:
+                    self.best = value
+                    self.best_metrics = dict(metrics)
+                time_last_eval = time.time()
+                metrics["time_eval"] = time_last_eval - time1
+                if self.scheduler is not None:
+                    self.scheduler.step(value)
+                metrics["time_scheduler"] = time.time() - time_last_eval
+
+            lr = get_lr(self.scheduler) if self.scheduler is not None else None
+            metrics["learning_rate"] = lr
+            for hook in self.hooks:
+                time1 = time.time()
+                hook(self, metrics)
+                name = getattr(hook, "__name__", type(hook).__name__)
+                metrics["time_" + name] = time.time() - time1
+            metrics["peak_memory"] = peak_memory()
+            metrics["time_epoch"] = time.time() - time0
+            yield metrics
+
+            if lr is not None and lr < self.min_lr:
+                break
+
+class Telemetry(object):
+    """Writes one JSON line per record to ``path`` (nothing if empty),
+    tagged with the ``static`` fields, e.g. the trial configuration.
+    Closes the file on leaving a ``with`` block."""
+    def __init__(self, path="", **static):
+        self.static = static
+        self.file = open(path, "a") if path else None
+
+    def __call__(self, record):
+        if self.file is None:
+            return
+        record = dict(self.static, time=time.time(), **record)
+        self.file.write(json.dumps(record, default=str) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,2 +1,112 @@
+import os
+import math
+from collections import OrderedDict
+import torch
+import dgl
+
+_REVERSE_CACHE = OrderedDict()
+_REVERSE_CACHE_SIZE = 8
+
+# reject unprepared graphs at the model entry points (see check_prepared)
+BENCHMARK = os.environ.get("BRONX_BENCHMARK", "0") not in ("", "0")
+
+def set_benchmark(enabled=True):
+    global BENCHMARK
+    BENCHMARK = enabled
+
+def add_reverse_edges(g):
+    """Structure-only symmetrized copy of ``g``, cached per graph structure
+    so that repeated calls on the same graph (or its ``local_var``) do not
+    rebuild it."""
+    key = id(g._graph)
+    cached = _REVERSE_CACHE.get(key)
+    if cached is not None and cached[0] is g._graph:
+        _REVERSE_CACHE.move_to_end(key)
+        return cached[1]
+    src, dst = g.edges()
+    rg = dgl.add_reverse_edges(dgl.graph((src, dst), num_nodes=g.number_of_nodes()))
+    rg.create_formats_()
+    _REVERSE_CACHE[key] = (g._graph, rg)
+    while len(_REVERSE_CACHE) > _REVERSE_CACHE_SIZE:
+        _REVERSE_CACHE.popitem(last=False)
+    return rg
+
+def _fits_int32(g):
+    return max(g.number_of_nodes(), g.number_of_edges()) < 2 ** 31
+
+def prepare_graph(g, reverse=True):
+    """Prepare ``g`` for training and inference: int32 indices where the
+    number of nodes and edges allows, every sparse format created up front
+    (shared by all ``local_var``-s of the graph) and, with ``reverse``,
+    the symmetrized graph of :func:`add_reverse_edges` cached.
+
+    Returns an int32 copy of ``g`` if it had int64 indices and ``g``
+    itself, with its formats created in place, otherwise.
+
+    Prepare the graph on the device it is used on; ``g.to(device)``
+    returns an unprepared graph.
+    """
+    if g.idtype != torch.int32 and _fits_int32(g):
+        g = g.int()
+    g.create_formats_()
+    if reverse:
+        add_reverse_edges(g)
+    return g
+
+def check_prepared(g, reverse=False):
+    """Raise a ``ValueError`` unless ``g`` was prepared with
+    :func:`prepare_graph` (with ``reverse`` if required)."""
+    problems = []
+    if g.idtype != torch.int32 and _fits_int32(g):
+        problems.append("int64 indices")
+    missing = g.formats()["not created"]
+    if len(missing) > 0:
+        problems.append("formats %s not created" % ", ".join(missing))
+    cached = _REVERSE_CACHE.get(id(g._graph))
+    if reverse and (cached is None or cached[0] is not g._graph):
+        problems.append("reverse edges not cached")
+    if len(problems) > 0:
+        raise ValueError(
+            "Graph is not prepared (%s), use bronx.utils.prepare_graph."
+            % "; ".join(problems)
+        )
+    return g
+
 def anneal_schedule(dt, t):
     return max(min(dt/t, 1.0), 1e-8)
+
+def diffusion_tail(t, gamma=1.0, hops=0, source=False):
+    """Bound on the error of truncating the diffusion operator
+    exp(t (A - gamma I)) after ``hops`` terms, for a row-normalized A,
+    relative to the features diffused, i.e.
+    exp(-gamma t) sum_{j > k} t^j / j!.
+
+    With ``source`` (the ``physique`` models, dh/dt = (A - gamma I) h + h(0))
+    the truncated integral of the source term, int_0^t tail(s) ds, is added,
+    i.e. exp(-gamma t) sum_{n > k + 1} t^n / n! sum_{m < n - k - 1} gamma^m.
+
+    The positive series is summed directly rather than subtracted from
+    its closed form, which would cancel for small tails.
+    """
+    term, tail, weight = math.exp(-gamma * t), 0.0, 0.0
+    n = 0
+    while term > 0.0:
+        n += 1
+        term = term * t / n
+        if n <= hops:
+            continue
+        contribution = term * (1.0 + weight) if source else term
+        tail = tail + contribution
+        weight = 1.0 + gamma * weight
+        if n > (1.0 + gamma) * t and contribution <= 1e-17 * tail:
+            break
+    return tail
+
+def diffusion_hops(t, gamma=1.0, tol=1e-3, max_hops=64, source=False):
+    """Number of hops after which the truncated series of the diffusion
+    operator is within ``tol`` of the exact one, see :func:`diffusion_tail`.
+    """
+    hops = 0
+    while hops < max_hops and diffusion_tail(t, gamma, hops, source=source) > tol:
+        hops += 1
+    return hops
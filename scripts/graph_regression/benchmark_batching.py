@@ -0,0 +1,102 @@
+import time
+import json
+import torch
+import pyro
+import dgl
+dgl.use_libxsmm(False)
+from run import get_data, get_model, get_loader
+from bronx.data import NFEBatchSampler
+
+def benchmark(args, bucket):
+    pyro.clear_param_store()
+    torch.manual_seed(args.seed)
+    data_train, data_valid, data_test = get_data(args)
+    _, g, y = next(iter(dgl.dataloading.GraphDataLoader(
+        data_train, batch_size=len(data_train),
+    )))
+    model = get_model(args, g, y)
+    data_train = get_loader(data_train, args.batch_size, bucket, drop_last=True)
+    sampler = data_train.batch_sampler
+
+    svi = pyro.infer.SVI(
+        model,
+        model.guide,
+        pyro.optim.Adam({"lr": args.learning_rate}),
+        loss=pyro.infer.TraceMeanField_ELBO(
+            num_particles=args.num_particles, vectorize_particles=True
+        ),
+    )
+
+    nfe, n_graphs = 0, 0
+    time0 = time.time()
+    for idx in range(args.n_epochs):
+        for idx_batch, (_, g, y) in enumerate(data_train):
+            model.train()
+            model.reset_nfe()
+            svi.step(g, g.ndata["h0"], y)
+            nfe += model.nfe
+            n_graphs += g.batch_size
+            if isinstance(sampler, NFEBatchSampler):
+                sampler.record(idx_batch, model.nfe)
+    time_train = time.time() - time0
+
+    model.eval()
+    model.reset_nfe()
+    data_valid = get_loader(data_valid, args.batch_size, bucket, shuffle=False)
+    predictive = pyro.infer.Predictive(
+        model,
+        guide=model.guide,
+        num_samples=args.num_samples,
+        parallel=True,
+        return_sites=["_RETURN"],
+    )
+    n_graphs_valid = 0
+    time0 = time.time()
+    with torch.no_grad():
+        for _, g, y in data_valid:
+            predictive(g, g.ndata["h0"])
+            n_graphs_valid += g.batch_size
+    time_valid = time.time() - time0
+
+    return {
+        "bucket": bucket,
+        "nfe_train": nfe,
+        "throughput_train": n_graphs / time_train,
+        "nfe_inference": model.nfe,
+        "throughput_inference": n_graphs_valid / time_valid,
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, default="ESOL")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--buckets", type=str, default="random,nodes,degree,nfe")
+    parser.add_argument("--hidden_features", type=int, default=100)
+    parser.add_argument("--embedding_features", type=int, default=20)
+    parser.add_argument("--activation", type=str, default="SiLU")
+    parser.add_argument("--learning_rate", type=float, default=1e-3)
+    parser.add_argument("--depth", type=int, default=1)
+    parser.add_argument("--num_samples", type=int, default=16)
+    parser.add_argument("--num_particles", type=int, default=4)
+    parser.add_argument("--num_heads", type=int, default=5)
+    parser.add_argument("--sigma_factor", type=float, default=2.0)
+    parser.add_argument("--t", type=float, default=1.0)
+    parser.add_argument("--kl_scale", type=float, default=1e-5)
+    parser.add_argument("--n_epochs", type=int, default=5)
+    parser.add_argument("--adjoint", type=int, default=0)
+    parser.add_argument("--physique", type=int, default=0)
+    parser.add_argument("--gamma", type=float, default=1.0)
+    parser.add_argument("--readout_depth", type=int, default=1)
+    parser.add_argument("--dropout_in", type=float, default=0.0)
+    parser.add_argument("--dropout_out", type=float, default=0.0)
+    parser.add_argument("--norm", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=2666)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+    report = [benchmark(args, bucket) for bucket in args.buckets.split(",")]
+    for result in report:
+        print(json.dumps(result), flush=True)
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,104 @@
+import os
+import time
+import json
+import torch
+import pyro
+import dgl
+dgl.use_libxsmm(False)
+from run import get_data, get_model, get_loader
+from bronx.infer import get_elbo, DistributedSVI, broadcast_parameters
+
+def worker(rank, world_size, args, queue):
+    import torch.distributed as dist
+    dist.init_process_group(
+        "gloo",
+        init_method="tcp://127.0.0.1:%d" % (args.port + world_size),
+        rank=rank,
+        world_size=world_size,
+    )
+    torch.set_num_threads(max(1, os.cpu_count() // world_size))
+    pyro.clear_param_store()
+    torch.manual_seed(args.seed)
+    data_train, _, _ = get_data(args)
+    _, g, y = next(iter(dgl.dataloading.GraphDataLoader(
+        data_train, batch_size=len(data_train),
+    )))
+    model = get_model(args, g, y)
+    broadcast_parameters(model)
+    torch.manual_seed(args.seed + rank)
+    data_train = get_loader(
+        data_train, args.batch_size, drop_last=True,
+        rank=rank, world_size=world_size, seed=args.seed,
+    )
+    svi = DistributedSVI(
+        model,
+        model.guide,
+        pyro.optim.Adam({"lr": args.learning_rate}),
+        loss=get_elbo(args.num_particles),
+    )
+
+    n_graphs = 0
+    dist.barrier()
+    time0 = time.time()
+    for idx in range(args.n_epochs):
+        for _, g, y in data_train:
+            model.train()
+            svi.step(g, g.ndata["h0"], y)
+            n_graphs += g.batch_size
+    dist.barrier()
+    duration = time.time() - time0
+
+    n_graphs = torch.tensor(float(n_graphs))
+    dist.all_reduce(n_graphs)
+    if rank == 0:
+        queue.put({"num_workers": world_size, "throughput": float(n_graphs) / duration})
+    dist.destroy_process_group()
+
+def benchmark(args):
+    context = torch.multiprocessing.get_context("spawn")
+    queue = context.SimpleQueue()
+    report = []
+    for world_size in range(1, args.max_workers + 1):
+        torch.multiprocessing.spawn(
+            worker, args=(world_size, args, queue), nprocs=world_size,
+        )
+        result = queue.get()
+        result["efficiency"] = result["throughput"] / (
+            world_size * (report[0]["throughput"] if report else result["throughput"])
+        )
+        print(json.dumps(result), flush=True)
+        report.append(result)
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, default="ESOL")
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--max_workers", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=29600)
+    parser.add_argument("--hidden_features", type=int, default=100)
+    parser.add_argument("--embedding_features", type=int, default=20)
+    parser.add_argument("--activation", type=str, default="SiLU")
+    parser.add_argument("--learning_rate", type=float, default=1e-3)
+    parser.add_argument("--depth", type=int, default=1)
+    parser.add_argument("--num_particles", type=int, default=4)
+    parser.add_argument("--num_heads", type=int, default=5)
+    parser.add_argument("--sigma_factor", type=float, default=2.0)
+    parser.add_argument("--t", type=float, default=1.0)
+    parser.add_argument("--kl_scale", type=float, default=1e-5)
+    parser.add_argument("--n_epochs", type=int, default=3)
+    parser.add_argument("--adjoint", type=int, default=0)
+    parser.add_argument("--physique", type=int, default=0)
+    parser.add_argument("--gamma", type=float, default=1.0)
+    parser.add_argument("--readout_depth", type=int, default=1)
+    parser.add_argument("--dropout_in", type=float, default=0.0)
+    parser.add_argument("--dropout_out", type=float, default=0.0)
+    parser.add_argument("--norm", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=2666)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+    report = benchmark(args)
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
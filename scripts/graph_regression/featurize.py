@@ -0,0 +1,103 @@
+import os
+import hashlib
+import dgl
+
+# bump whenever the featurization below changes
+CACHE_VERSION = 1
+
+# next to this script rather than in the working directory, which is the
+# trial directory of every tuning trial
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+
+def get_featurizers():
+    from dgllife.utils import (
+        CanonicalAtomFeaturizer,
+        CanonicalBondFeaturizer,
+    )
+    return CanonicalAtomFeaturizer("h0"), CanonicalBondFeaturizer("e0")
+
+def cache_path(name, cache_dir, smiles_column="smiles", task_names=None):
+    import dgllife
+    from rdkit import rdBase
+    node_featurizer, edge_featurizer = get_featurizers()
+    key = [
+        str(CACHE_VERSION),
+        dgllife.__version__,
+        rdBase.rdkitVersion,
+        dgl.__version__,
+        type(node_featurizer).__name__,
+        type(edge_featurizer).__name__,
+        str(node_featurizer.feat_size()),
+        str(edge_featurizer.feat_size()),
+    ]
+    if name.endswith(".csv"):
+        # a different, moved or edited file, or other columns, is a miss
+        stat = os.stat(name)
+        key += [
+            os.path.abspath(name),
+            str(stat.st_size),
+            str(stat.st_mtime_ns),
+            smiles_column,
+            repr(task_names),
+        ]
+    key = ",".join(key)
+    digest = hashlib.sha1(key.encode()).hexdigest()[:12]
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, f"{os.path.basename(name)}-{digest}.bin")
+
+def get_dataset(name, cache_dir=CACHE_DIR, n_jobs=1, smiles_column="smiles", task_names=None):
+    """Featurized molecule dataset, loaded from a versioned binary cache
+    when available and otherwise featurized over ``n_jobs`` processes.
+
+    ``name`` is either one of the dgllife datasets (``ESOL``, ``FreeSolv``,
+    ``Lipophilicity``) or the path to a csv file with a ``smiles_column``.
+    """
+    from dgllife.data import (
+        ESOL,
+        FreeSolv,
+        Lipophilicity,
+    )
+    from dgllife.utils import smiles_to_bigraph
+    node_featurizer, edge_featurizer = get_featurizers()
+    path = cache_path(
+        name, cache_dir, smiles_column=smiles_column, task_names=task_names,
+    )
+    # featurize into a private file and move it into place atomically, so
+    # that concurrent (e.g. DDP) processes never load a partial cache
+    cached = os.path.exists(path)
+    kwargs = dict(
+        smiles_to_graph=smiles_to_bigraph,
+        node_featurizer=node_featurizer,
+        edge_featurizer=edge_featurizer,
+        load=True,
+        cache_file_path=path if cached else f"{path}.{os.getpid()}.tmp",
+        n_jobs=n_jobs,
+    )
+
+    if name.endswith(".csv"):
+        import pandas as pd
+        from dgllife.data import MoleculeCSVDataset
+        df = pd.read_csv(name)
+        data = MoleculeCSVDataset(
+            df, smiles_column=smiles_column, task_names=task_names, **kwargs,
+        )
+    else:
+        data = locals()[name](**kwargs)
+
+    if not cached:
+        os.replace(kwargs["cache_file_path"], path)
+    return data
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, default="ESOL")
+    parser.add_argument("--cache_dir", type=str, default=CACHE_DIR)
+    parser.add_argument("--n_jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--smiles_column", type=str, default="smiles")
+    args = parser.parse_args()
+    data = get_dataset(
+        args.data, cache_dir=args.cache_dir, n_jobs=args.n_jobs,
+        smiles_column=args.smiles_column,
+    )
+    print(cache_path(args.data, args.cache_dir, smiles_column=args.smiles_column), len(data))
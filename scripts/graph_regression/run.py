@@ -7,34 +7,31 @@ from pyro import poutine
 import dgl
 dgl.use_libxsmm(False)
 from bronx.models import GraphRegressionBronxModel
-from bronx.optim import SWA, swap_swa_sgd
+from bronx.infer import get_elbo, DistributedSVI, broadcast_parameters
+from bronx.data import graph_keys, BucketBatchSampler, NFEBatchSampler, ShardedBatchSampler
+from bronx.optim import WeightAverage
+from bronx.train import Trainer, Telemetry
+from bronx import utils
+from bronx.utils import prepare_graph
+from featurize import get_dataset, CACHE_DIR
 
-def run(args):
-    pyro.clear_param_store()
-    from dgllife.data import (
-        ESOL,
-        FreeSolv,
-        Lipophilicity,
-    )
-    from dgllife.utils import (
-        CanonicalAtomFeaturizer,
-        CanonicalBondFeaturizer,
-    )
-    data = locals()[args.data](
-        node_featurizer=CanonicalAtomFeaturizer("h0"),
-        edge_featurizer=CanonicalBondFeaturizer("e0"),
+def get_data(args):
+    data = get_dataset(
+        args.data,
+        cache_dir=getattr(args, "cache_dir", CACHE_DIR),
+        n_jobs=getattr(args, "n_jobs", 1),
     )
+    # int32 once here, so that every batch is int32 without a cast
+    data.graphs = [g.int() for g in data.graphs]
     from dgllife.utils import RandomSplitter
     splitter = RandomSplitter()
     data_train, data_valid, data_test = splitter.train_val_test_split(
         data, frac_train=0.8, frac_val=0.1, frac_test=0.1, 
         random_state=args.seed,
     )
+    return data_train, data_valid, data_test
 
-    _, g, y = next(iter(dgl.dataloading.GraphDataLoader(
-        data_train, batch_size=len(data_train),
-    )))
-
+def get_model(args, g, y):
     model = GraphRegressionBronxModel(
         in_features=g.ndata["h0"].shape[-1],
         out_features=1,
@@ -53,21 +50,51 @@ def run(args):
         dropout_in=args.dropout_in,
         dropout_out=args.dropout_out,
         norm=bool(args.norm),
+        fused=bool(getattr(args, "fused", 0)),
         y_mean=y.mean(),
         y_std=y.std(),
     )
+    return model
+
+def check_args(args, world_size=1):
+    # data-parallel workers would disagree on when to evaluate and on the
+    # recorded NFE of their batches
+    if world_size > 1 and getattr(args, "eval_time", 0.0) > 0:
+        raise ValueError("--eval_time is not supported with multiple workers.")
+    if world_size > 1 and getattr(args, "bucket", "random") == "nfe":
+        raise ValueError("NFE bucketing is not supported with multiple workers.")
+
+def run(args, rank=0, world_size=1):
+    check_args(args, world_size=world_size)
+    pyro.clear_param_store()
+    data_train, data_valid, data_test = get_data(args)
+
+    _, g, y = next(iter(dgl.dataloading.GraphDataLoader(
+        data_train, batch_size=len(data_train),
+    )))
+
+    model = get_model(args, g, y)
 
-    if torch.cuda.is_available():
+    if world_size > 1:
+        broadcast_parameters(model)
+        torch.manual_seed(args.seed + rank)
+    elif torch.cuda.is_available():
         model = model.to("cuda:0")
+    device = next(model.parameters()).device
+    reverse = model.edge_recover is not None
 
     batch_size = args.batch_size if args.batch_size > 0 else len(data_train)
 
-    data_train = dgl.dataloading.GraphDataLoader(
-        data_train, batch_size=batch_size, shuffle=True, drop_last=True
+    data_train = get_loader(
+        data_train, batch_size, args.bucket, drop_last=True,
+        rank=rank, world_size=world_size, seed=args.seed,
     )
+    sampler_train = data_train.batch_sampler
 
-    data_valid = dgl.dataloading.GraphDataLoader(
-        data_valid, batch_size=len(data_valid),
+    valid_batch_size = batch_size if args.bucket != "random" else len(data_valid)
+    data_valid = prepare_batches(
+        get_loader(data_valid, valid_batch_size, args.bucket, shuffle=False),
+        device, reverse=reverse,
     )
 
     scheduler = pyro.optim.ReduceLROnPlateau(
@@ -83,51 +110,156 @@ def run(args):
         },
     )
 
-    svi = pyro.infer.SVI(
+    svi = (DistributedSVI if world_size > 1 else pyro.infer.SVI)(
         model,
         model.guide,
         scheduler,
-        loss=pyro.infer.TraceMeanField_ELBO(
-            num_particles=args.num_particles, vectorize_particles=True
+        loss=get_elbo(
+            args.num_particles, getattr(args, "particle_chunk_size", 0),
         ),
     )
 
-    for idx in range(args.n_epochs):
-        for _, g, y in data_train:
-            if torch.cuda.is_available():
-                g = g.to("cuda:0")
-                y = y.to("cuda:0")
+    average = getattr(args, "average", "none")
+    if average != "none":
+        # parameters are identical on every worker, and so are their averages
+        average = WeightAverage(
+            decay=args.ema_decay if average == "ema" else None,
+            start=args.average_start,
+            freq=args.average_freq,
+        )
+    else:
+        average = None
+
+    def step(epoch):
+        for idx_batch, (_, g, y) in enumerate(data_train):
+            # the formats of a (shuffled, so ever new) training batch are
+            # built by its first message passing and reused by the solver
+            g, y = g.to(device), y.to(device)
+            if utils.BENCHMARK:
+                g = prepare_graph(g, reverse=reverse)
             model.train()
+            nfe = model.nfe
             loss = svi.step(g, g.ndata["h0"], y)
-    
-        _, g, y = next(iter(data_valid))
-        if torch.cuda.is_available():
-            g = g.to("cuda:0")
-            y = y.to("cuda:0")
-
-        model.eval()
-        with torch.no_grad():
-
-            predictive = pyro.infer.Predictive(
-                model,
-                guide=model.guide,
-                num_samples=args.num_samples,
-                parallel=True,
-                return_sites=["_RETURN"],
+            if isinstance(sampler_train, NFEBatchSampler):
+                sampler_train.record(idx_batch, model.nfe - nfe)
+            if average is not None:
+                average.update()
+        return loss
+
+    def validate():
+        if rank == 0:
+            if average is not None:
+                with average.averaged():
+                    rmse = evaluate(model, data_valid, args.num_samples)
+            else:
+                rmse = evaluate(model, data_valid, args.num_samples)
+        if world_size > 1:
+            rmse = torch.tensor(rmse if rank == 0 else 0.0)
+            torch.distributed.broadcast(rmse, 0)
+            rmse = float(rmse)
+        if rank == 0:
+            print(rmse)
+        return {"rmse": rmse}
+
+    eval_time = getattr(args, "eval_time", 0.0)
+    trainer = Trainer(
+        step,
+        evaluate=validate,
+        scheduler=scheduler,
+        metric="rmse",
+        mode="min",
+        eval_every=getattr(args, "eval_every", 1),
+        eval_time=eval_time,
+        model=model,
+    )
+    with Telemetry(
+        getattr(args, "telemetry", "") if rank == 0 else "", data=args.data,
+    ) as telemetry:
+        for metrics in trainer.run(args.n_epochs):
+            if "rmse" in metrics:
+                rmse = metrics["rmse"]
+            telemetry(metrics)
+
+    return rmse
+
+def get_loader(
+        data, batch_size, bucket="random", shuffle=True, drop_last=False,
+        rank=0, world_size=1, seed=0,
+    ):
+    if bucket == "random":
+        if world_size == 1:
+            return dgl.dataloading.GraphDataLoader(
+                data, batch_size=batch_size, shuffle=shuffle, drop_last=drop_last,
             )
+        sampler = torch.utils.data.BatchSampler(
+            torch.utils.data.RandomSampler(data) if shuffle
+            else torch.utils.data.SequentialSampler(data),
+            batch_size=batch_size, drop_last=drop_last,
+        )
+    else:
+        keys = graph_keys(
+            [data[idx][1] for idx in range(len(data))],
+            by="nodes" if bucket == "nfe" else bucket,
+        )
+        sampler = NFEBatchSampler if bucket == "nfe" else BucketBatchSampler
+        sampler = sampler(keys, batch_size, shuffle=shuffle, drop_last=drop_last)
+    if world_size > 1:
+        sampler = ShardedBatchSampler(sampler, rank, world_size, seed=seed)
+    return dgl.dataloading.GraphDataLoader(data, batch_sampler=sampler)
 
-            y_hat = predictive(g, g.ndata["h0"])["_RETURN"].mean(0)
-            rmse = float(((y_hat - y) ** 2).mean() ** 0.5)
-        scheduler.step(rmse)
-        print(rmse)
+def worker(rank, args):
+    # one data-parallel CPU worker, see --num_workers
+    import os
+    import torch.distributed as dist
+    dist.init_process_group(
+        "gloo", 
+        init_method="tcp://127.0.0.1:%d" % args.port,
+        rank=rank, 
+        world_size=args.num_workers,
+    )
+    torch.set_num_threads(max(1, os.cpu_count() // args.num_workers))
+    torch.manual_seed(args.seed)
+    rmse = run(args, rank=rank, world_size=args.num_workers)
+    dist.destroy_process_group()
+    return rmse
+
+def prepare_batches(loader, device, reverse=False):
+    # the fixed evaluation batches are moved and prepared once
+    return [
+        (prepare_graph(g.to(device), reverse=reverse), y.to(device))
+        for _, g, y in loader
+    ]
 
+def evaluate(model, data, num_samples):
+    model.eval()
+    predictive = pyro.infer.Predictive(
+        model,
+        guide=model.guide,
+        num_samples=num_samples,
+        parallel=True,
+        return_sites=["_RETURN"],
+    )
+
+    ys, ys_hat = [], []
+    with torch.no_grad():
+        for g, y in data:
+            ys_hat.append(predictive(g, g.ndata["h0"])["_RETURN"].mean(0))
+            ys.append(y)
+    y_hat, y = torch.cat(ys_hat), torch.cat(ys)
+    rmse = float(((y_hat - y) ** 2).mean() ** 0.5)
     return rmse
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--data", type=str, default="ESOL")
+    parser.add_argument("--cache_dir", type=str, default=CACHE_DIR)
+    parser.add_argument("--n_jobs", type=int, default=1)
     parser.add_argument("--batch_size", type=int, default=-1)
+    parser.add_argument(
+        "--bucket", type=str, default="random",
+        choices=["random", "nodes", "edges", "degree", "nfe"],
+    )
     parser.add_argument("--hidden_features", type=int, default=100)
     parser.add_argument("--embedding_features", type=int, default=20)
     parser.add_argument("--activation", type=str, default="SiLU")
@@ -136,6 +268,7 @@ if __name__ == "__main__":
     parser.add_argument("--depth", type=int, default=1)
     parser.add_argument("--num_samples", type=int, default=64)
     parser.add_argument("--num_particles", type=int, default=4)
+    parser.add_argument("--particle_chunk_size", type=int, default=0)
     parser.add_argument("--num_heads", type=int, default=5)
     parser.add_argument("--sigma_factor", type=float, default=2.0)
     parser.add_argument("--t", type=float, default=1.0)
@@ -146,6 +279,12 @@ if __name__ == "__main__":
     parser.add_argument("--physique", type=int, default=0)
     parser.add_argument("--gamma", type=float, default=1.0)
     parser.add_argument("--readout_depth", type=int, default=1)
+    parser.add_argument(
+        "--fused", type=int, default=0,
+        help="solve all layers at once; for depth > 1 every layer's edge "
+        "posterior is computed from the input features, which changes the model; "
+        "requires --physique 0",
+    )
     parser.add_argument("--dropout_in", type=float, default=0.0)
     parser.add_argument("--dropout_out", type=float, default=0.0)
     parser.add_argument("--norm", type=int, default=1)
@@ -155,5 +294,18 @@ if __name__ == "__main__":
     parser.add_argument("--seed", type=int, default=2666)
     parser.add_argument("--lr_factor", type=float, default=0.5)
     parser.add_argument("--patience", type=int, default=10)
+    parser.add_argument("--eval_every", type=int, default=1)
+    parser.add_argument("--eval_time", type=float, default=0.0)
+    parser.add_argument("--telemetry", type=str, default="")
+    parser.add_argument("--average", type=str, default="none", choices=["none", "swa", "ema"])
+    parser.add_argument("--average_start", type=int, default=0)
+    parser.add_argument("--average_freq", type=int, default=1)
+    parser.add_argument("--ema_decay", type=float, default=0.999)
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=29500)
     args = parser.parse_args()
-    run(args)
+    check_args(args, world_size=args.num_workers)
+    if args.num_workers > 1:
+        torch.multiprocessing.spawn(worker, args=(args,), nprocs=args.num_workers)
+    else:
+        run(args)
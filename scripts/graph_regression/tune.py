@@ -1,3 +1,4 @@
+import os
 from types import SimpleNamespace
 from datetime import datetime
 from run import run
@@ -5,6 +6,7 @@ import ray
 from ray import tune, air, train
 from ray.tune.trainable import session
 from ray.tune.search.optuna import OptunaSearch
+from featurize import CACHE_DIR
 
 def objective(args):
     args["embedding_features"] = (
@@ -21,10 +23,13 @@ def experiment(args):
 
     param_space = {
         "data": tune.choice([args.data]),
+        # trials run in their own directories, but share one cache
+        "cache_dir": tune.choice([os.path.abspath(args.cache_dir)]),
         "hidden_features": tune.randint(8, 16),
         "embedding_features": tune.randint(8, 16),
         "num_heads": tune.randint(4, 16),
         "depth": tune.randint(1, 6),
+        "fused": tune.choice([args.fused]),
         "learning_rate": tune.loguniform(1e-4, 5e-2),
         "weight_decay": tune.loguniform(1e-6, 1e-2),
         "num_samples": tune.choice([16]),
@@ -56,5 +61,10 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--data", type=str, default="CoraGraphDataset")
+    parser.add_argument("--cache_dir", type=str, default=CACHE_DIR)
+    parser.add_argument(
+        "--fused", type=int, default=0,
+        help="also search the fused solve, a different model for depth > 1",
+    )
     args = parser.parse_args()
     experiment(args)
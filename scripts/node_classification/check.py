@@ -1,6 +1,3 @@
-import os
-import glob
-import json
 from re import S
 import pandas as pd
 import torch
@@ -9,18 +6,9 @@ import dgl
 from types import SimpleNamespace
 
 def check(args):
-    results = []
-    result_paths = glob.glob(args.path + "/*/*/result.json")
-    for result_path in result_paths:
-        try:
-            with open(result_path, "r") as f:
-                result_str = f.read()
-                result = json.loads(result_str)
-            results.append(result)
-        except:
-            pass
-
-    results = sorted(results, key=lambda x: x["_metric"]["accuracy"], reverse=True)
+    from results import get_index
+    index = get_index(args)
+    results = index.top(None if len(args.report) > 1 else 1, metric="accuracy")
 
     print(results[0]["_metric"]["accuracy"], results[0]["_metric"]["accuracy_te"])
     print(results[0]["config"], flush=True)
@@ -31,7 +19,8 @@ def check(args):
         df["accuracy_te"] = [result["_metric"]["accuracy_te"] for result in results]
         df.to_csv(args.report)
 
-    from run import get_graph
+    from run import get_graph, get_labels
+    from bronx.utils import prepare_graph
     g = get_graph(results[0]["config"]["data"])
 
 
@@ -51,6 +40,7 @@ def check(args):
         else:
             model = torch.load(results[0]["config"]["checkpoint"], map_location="cpu")
         model.eval()
+        g = prepare_graph(g, reverse=model.edge_recover is not None)
 
         with torch.no_grad():
             predictive = pyro.infer.Predictive(
@@ -66,8 +56,8 @@ def check(args):
             ]
             
             y_hat = y_hat.softmax(-1).mean(0)
-            y = g.ndata["label"][g.ndata["val_mask"]]
-            accuracy_vl = float((y_hat.argmax(-1) == y.argmax(-1)).sum()) / len(
+            y = get_labels(g.ndata["label"][g.ndata["val_mask"]])
+            accuracy_vl = float((y_hat.argmax(-1) == y).sum()) / len(
                 y_hat
             )
 
@@ -76,17 +66,55 @@ def check(args):
             ]
             
             y_hat = y_hat.softmax(-1).mean(0)
-            y = g.ndata["label"][g.ndata["test_mask"]]
-            accuracy_te = float((y_hat.argmax(-1) == y.argmax(-1)).sum()) / len(
+            y = get_labels(g.ndata["label"][g.ndata["test_mask"]])
+            accuracy_te = float((y_hat.argmax(-1) == y).sum()) / len(
                 y_hat
             )
             print(accuracy_vl, accuracy_te)
 
+            if args.local_tol > 0:
+                from bronx.predict import query_error
+                nodes = torch.where(g.ndata["test_mask"])[0]
+                print(
+                    query_error(
+                        model, g, g.ndata["feat"], nodes, 
+                        num_samples=64, tol=args.local_tol,
+                    )
+                )
+
+            if args.sparsify_threshold > 0 or args.sparsify_k > 0:
+                from bronx.predict import SparsePredictor
+                predictor = SparsePredictor(
+                    model, g, g.ndata["feat"],
+                    threshold=args.sparsify_threshold or None,
+                    k=args.sparsify_k or None,
+                    num_samples=64,
+                )
+                print(
+                    predictor.compare(
+                        mask=g.ndata["test_mask"],
+                        y=get_labels(g.ndata["label"][g.ndata["test_mask"]]),
+                    )
+                )
+
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--path", type=str, default=".")
     parser.add_argument("--report", type=str, default="")
+    parser.add_argument("--index", type=str, default="")
+    parser.add_argument("--collect", type=int, default=0)
     parser.add_argument("--rerun", type=int, default=0)
+    parser.add_argument("--reevaluate", type=int, default=0)
+    parser.add_argument("--local_tol", type=float, default=0.0)
+    parser.add_argument(
+        "--sparsify_threshold", type=float, default=0.0,
+        help="drop edges whose normalized posterior-median weight is below this",
+    )
+    parser.add_argument(
+        "--sparsify_k", type=int, default=0,
+        help="keep the k in-edges of every node with the largest normalized "
+        "posterior-median weight, sigmoid(loc), not the posterior mean",
+    )
     args = parser.parse_args()
     check(args)
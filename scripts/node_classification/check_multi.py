@@ -1,32 +1,20 @@
-import os
-import glob
-import json
 import pandas as pd
 import torch
 import pyro
 import dgl
 
 def check(args):
-    results = []
-    result_paths = glob.glob(args.path + "/*/*/result.json")
-    for result_path in result_paths:
-        try:
-            with open(result_path, "r") as f:
-                result_str = f.read()
-                result = json.loads(result_str)
-            results.append(result)
-        except:
-            pass
-
-    results = sorted(results, key=lambda x: x["_metric"]["accuracy"], reverse=True)
+    from results import get_index
+    index = get_index(args)
+    results = index.top(args.first, metric="accuracy")
 
     from run import get_graph
     g = get_graph(results[0]["config"]["data"])
-    y = g.ndata["label"].argmax(-1)
+    y = g.ndata["label"]
 
     ys_hat = []
     with torch.no_grad():
-        for idx in range(args.first):
+        for idx in range(len(results)):
             if torch.cuda.is_available():
                 model = torch.load(results[idx]["config"]["checkpoint"])
                 g = g.to("cuda:0")
@@ -61,6 +49,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--path", type=str, default=".")
     parser.add_argument("--first", type=int, default=16)
+    parser.add_argument("--index", type=str, default="")
+    parser.add_argument("--collect", type=int, default=0)
     parser.add_argument("--num_samples", type=int, default=32)
     args = parser.parse_args()
     check(args)
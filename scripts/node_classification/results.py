@@ -0,0 +1,141 @@
+import os
+import glob
+import json
+import time
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    accuracy REAL,
+    accuracy_te REAL,
+    config TEXT,
+    metrics TEXT
+);
+CREATE INDEX IF NOT EXISTS trials_accuracy ON trials (accuracy);
+CREATE INDEX IF NOT EXISTS trials_accuracy_te ON trials (accuracy_te);
+"""
+
+COLUMNS = ["accuracy", "accuracy_te"]
+
+# one index next to the scripts, shared by the tuning and the check scripts
+# whatever their working directory (tuning trials run in their own)
+INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.sqlite")
+
+class ResultsIndex(object):
+    """SQLite index of tuning results.
+
+    Trials append to it as they report (see :func:`trial_path`) and the
+    check scripts query it for the top trials instead of rescanning and
+    parsing every ``result.json``; :meth:`collect` backfills results
+    written without an index.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.executescript(SCHEMA)
+
+    def add(self, path, result, mtime=0.0):
+        metrics = result.get("_metric", result)
+        metrics = {
+            key: value for key, value in metrics.items()
+            if isinstance(value, (int, float))
+        }
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    path,
+                    mtime,
+                    metrics.get("accuracy"),
+                    metrics.get("accuracy_te"),
+                    json.dumps(result.get("config", {})),
+                    json.dumps(metrics),
+                ),
+            )
+
+    def collect(self, root):
+        """Index the ``result.json`` files under ``root`` that are new or
+        changed since they were last indexed. Returns the number of
+        (re)indexed trials."""
+        indexed = dict(self.connection.execute("SELECT path, mtime FROM trials"))
+        count = 0
+        for path in glob.glob(os.path.join(root, "*", "*", "result.json")):
+            mtime = os.path.getmtime(path)
+            if indexed.get(path) == mtime:
+                continue
+            with open(path, "r") as f:
+                lines = [line for line in f.read().splitlines() if line.strip()]
+            if len(lines) == 0:
+                continue
+            try:
+                # one line per report, the last one holds the final metrics
+                result = json.loads(lines[-1])
+            except json.JSONDecodeError as error:
+                print(f"skipping {path}: {error}", flush=True)
+                continue
+            self.add(path, result, mtime=mtime)
+            count += 1
+        return count
+
+    def top(self, k=None, metric="accuracy", filters=None, descending=True):
+        """Top ``k`` trials by ``metric``, optionally restricted to trials
+        whose config matches every ``key: value`` in ``filters``.
+
+        The results mirror the layout of ``result.json``:
+        ``{"config": ..., "_metric": ...}``.
+        """
+        if metric in COLUMNS:
+            order = metric
+        else:
+            order = "json_extract(metrics, '$.%s')" % metric.replace("'", "")
+        query = "SELECT config, metrics FROM trials"
+        params = []
+        if filters:
+            query += " WHERE " + " AND ".join(
+                "json_extract(config, ?) = ?" for _ in filters
+            )
+            for key, value in filters.items():
+                params.extend(["$." + key, value])
+        query += " ORDER BY %s IS NULL, %s %s" % (
+            order, order, "DESC" if descending else "ASC",
+        )
+        if k is not None:
+            query += " LIMIT ?"
+            params.append(k)
+        return [
+            {"config": json.loads(config), "_metric": json.loads(metrics)}
+            for config, metrics in self.connection.execute(query, params)
+        ]
+
+def trial_path():
+    # the row of the calling trial, keyed like the rows of ``collect``
+    from ray.air import session
+    return os.path.join(session.get_trial_dir(), "result.json")
+
+def add_trial(index, config, metrics):
+    index.add(trial_path(), {"config": config, **metrics}, mtime=time.time())
+
+def index_path(args):
+    return os.path.abspath(args.index or INDEX)
+
+def get_index(args):
+    index = ResultsIndex(index_path(args))
+    if getattr(args, "collect", 0):
+        index.collect(args.path)
+    return index
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", type=str, default=".")
+    parser.add_argument("--index", type=str, default="")
+    parser.add_argument("--collect", type=int, default=0)
+    parser.add_argument("--metric", type=str, default="accuracy")
+    parser.add_argument("--first", type=int, default=10)
+    parser.add_argument("--filter", type=str, default="{}")
+    args = parser.parse_args()
+    index = get_index(args)
+    for result in index.top(args.first, metric=args.metric, filters=json.loads(args.filter)):
+        print(json.dumps(result), flush=True)
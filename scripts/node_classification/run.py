@@ -1,3 +1,5 @@
+import time
+import functools
 import numpy as np
 import torch
 import pyro
@@ -6,11 +8,14 @@ import dgl
 from ogb.nodeproppred import DglNodePropPredDataset
 dgl.use_libxsmm(False)
 from bronx.models import NodeClassificationBronxModel
+from bronx.infer import get_elbo
+from bronx.train import Trainer, Telemetry
+from bronx.utils import prepare_graph
 from ray.air import session
 import warnings
 warnings.filterwarnings("ignore")
 
-def get_graph(data):
+def get_graph(data, one_hot=False):
     from dgl.data import (
         CoraGraphDataset,
         CiteseerGraphDataset,
@@ -22,14 +27,18 @@ def get_graph(data):
         CornellDataset,
     )
 
-    g = locals()[data](verbose=False)[0]
+    if data.startswith("Synthetic-"):
+        # e.g. Synthetic-100000, a seeded power-law block model graph
+        from bronx.synthetic import node_classification_graph
+        g = node_classification_graph(int(data.split("-")[1]))
+    else:
+        g = locals()[data](verbose=False)[0]
     g = dgl.remove_self_loop(g)
     # g = dgl.add_reverse_edges(g)
     # g = dgl.add_self_loop(g)
     # src, dst = g.edges()
     # eids = torch.where(src > dst)[0]
     # g = dgl.remove_edges(g, eids)
-    g.ndata["label"] = torch.nn.functional.one_hot(g.ndata["label"])
 
     if "train_mask" not in g.ndata:
         g.ndata["train_mask"] = torch.zeros(g.number_of_nodes(), dtype=torch.bool)
@@ -40,9 +49,9 @@ def get_graph(data):
         val_idxs = torch.tensor([], dtype=torch.int32)
         test_idxs = torch.tensor([], dtype=torch.int32)
 
-        n_classes = g.ndata["label"].shape[-1]
+        n_classes = int(g.ndata["label"].max()) + 1
         for idx_class in range(n_classes):
-            idxs = torch.where(g.ndata["label"][:, idx_class] == 1)[0]
+            idxs = torch.where(g.ndata["label"] == idx_class)[0]
             assert len(idxs) > 50
             idxs = idxs[torch.randperm(len(idxs))]
             _train_idxs = idxs[:20]
@@ -55,28 +64,92 @@ def get_graph(data):
         g.ndata["train_mask"][train_idxs] = True
         g.ndata["val_mask"][val_idxs] = True
         g.ndata["test_mask"][test_idxs] = True
+
+    if one_hot:
+        g.ndata["label"] = torch.nn.functional.one_hot(g.ndata["label"])
     return g
 
-def run(args):
+def get_mmap_features(g, path, key, featurize=lambda g: g.ndata["feat"]):
+    """Node features of ``g`` memory-mapped from the ``.npy`` file ``path``,
+    so that they stay on disk and are streamed through fc_in in chunks.
+
+    The file is tagged with ``key`` (the dataset and its featurization) in
+    a sidecar ``path + ".key"`` and is only (re)written from
+    ``featurize(g)`` when the tag differs; otherwise the in-memory
+    features are never touched.
+    """
+    import os
+    if os.path.exists(path) and os.path.exists(path + ".key"):
+        with open(path + ".key", "r") as f:
+            if f.read() == key:
+                return np.load(path, mmap_mode="r")
+    tmp = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp, featurize(g).numpy())
+    # untag first, so that an interrupted rewrite is never mistaken as valid
+    if os.path.exists(path + ".key"):
+        os.remove(path + ".key")
+    os.replace(tmp, path)
+    with open(tmp + ".key", "w") as f:
+        f.write(key)
+    os.replace(tmp + ".key", path + ".key")
+    return np.load(path, mmap_mode="r")
+
+def get_labels(y):
+    if y.dim() > 1:
+        y = y.argmax(-1)
+    return y
+
+def get_num_classes(y):
+    if y.dim() > 1:
+        return y.shape[-1]
+    return int(y.max()) + 1
+
+@functools.lru_cache(maxsize=4)
+def get_graph_cached(data, one_hot=False):
+    # long-lived trial workers load every dataset only once
+    return get_graph(data, one_hot=one_hot)
+
+def train(args, state=None):
+    """Train a model, optionally continuing from a training ``state``, and
+    yield the metrics and a function returning the training state after
+    every epoch."""
     pyro.clear_param_store()
     # torch.cuda.empty_cache()
     if args.seed > 0:
         torch.manual_seed(args.seed)
 
-    g = get_graph(args.data)
+    if getattr(args, "mmap_features", ""):
+        # the datasets are loaded into memory; an uncached graph at least
+        # frees its features once they are dropped below
+        g = get_graph(args.data, one_hot=bool(getattr(args, "one_hot", 0)))
+    else:
+        g = get_graph_cached(args.data, one_hot=bool(getattr(args, "one_hot", 0)))
+    g = g.local_var()
 
     if args.split_index >= 0:
         g.ndata["train_mask"] = g.ndata["train_mask"][:, args.split_index]
         g.ndata["val_mask"] = g.ndata["val_mask"][:, args.split_index]
         g.ndata["test_mask"] = g.ndata["test_mask"][:, args.split_index]
 
-    if args.k > 0:
-        h_pe = dgl.random_walk_pe(g, k=args.k)
-        g.ndata["feat"] = torch.cat([g.ndata["feat"], h_pe], dim=-1)
+    def featurize(g):
+        feat = g.ndata["feat"]
+        if args.k > 0:
+            h_pe = dgl.random_walk_pe(g, k=args.k)
+            feat = torch.cat([feat, h_pe], dim=-1)
+        return feat
+
+    if getattr(args, "mmap_features", ""):
+        features = get_mmap_features(
+            g, args.mmap_features, key="%s,k=%d" % (args.data, args.k),
+            featurize=featurize,
+        )
+        g.ndata.pop("feat")
+    else:
+        features = g.ndata["feat"] = featurize(g)
 
     model = NodeClassificationBronxModel(
-        in_features=g.ndata["feat"].shape[-1],
-        out_features=g.ndata["label"].shape[-1],
+        in_features=features.shape[-1],
+        out_features=get_num_classes(g.ndata["label"]),
         hidden_features=args.hidden_features,
         embedding_features=args.embedding_features,
         depth=args.depth,
@@ -96,12 +169,21 @@ def run(args):
         norm=bool(args.norm),
         node_prior=bool(args.node_prior),
         edge_recover=args.edge_recover,
+        edge_recover_negatives=getattr(args, "edge_recover_negatives", 1),
+        chunk_size=getattr(args, "chunk_size", 0) or None,
+        hidden_cache=getattr(args, "hidden_cache", "") or None,
+        fused=bool(getattr(args, "fused", 0)),
+        multilevel=getattr(args, "multilevel", 0),
+        fine_fraction=getattr(args, "fine_fraction", 0.1),
     )
  
     if torch.cuda.is_available():
         # a = a.cuda()
         model = model.cuda()
         g = g.to("cuda:0")
+        if isinstance(features, torch.Tensor):
+            features = g.ndata["feat"]
+    g = prepare_graph(g, reverse=args.edge_recover > 0)
 
     scheduler = pyro.optim.ReduceLROnPlateau(
         {
@@ -120,19 +202,18 @@ def run(args):
         model,
         model.guide,
         scheduler,
-        loss=pyro.infer.TraceMeanField_ELBO(
-            num_particles=args.num_particles, vectorize_particles=True
+        loss=get_elbo(
+            args.num_particles, getattr(args, "particle_chunk_size", 0),
         ),
     )
     
-    accuracy_vl_max = 0.0
-    accuracy_te_max = 0.0
-    for idx in range(args.n_epochs):
+    def step(epoch):
         model.train()
-        loss = svi.step(
-            g, g.ndata["feat"], y=g.ndata["label"], mask=g.ndata["train_mask"]
+        return svi.step(
+            g, features, y=g.ndata["label"], mask=g.ndata["train_mask"]
         )
 
+    def evaluate():
         model.eval()
         with torch.no_grad():
             predictive = pyro.infer.Predictive(
@@ -143,36 +224,134 @@ def run(args):
                 return_sites=["_RETURN"],
             )
 
-            y_hat = predictive(g, g.ndata["feat"], mask=g.ndata["val_mask"])[
+            y_hat = predictive(g, features, mask=g.ndata["val_mask"])[
                 "_RETURN"
             ].mean(0)
-            y = g.ndata["label"][g.ndata["val_mask"]]
-            accuracy_vl = float((y_hat.argmax(-1) == y.argmax(-1)).sum()) / len(
+            y = get_labels(g.ndata["label"][g.ndata["val_mask"]])
+            accuracy_vl = float((y_hat.argmax(-1) == y).sum()) / len(
                 y_hat
             )
 
-            y_hat = predictive(g, g.ndata["feat"], mask=g.ndata["test_mask"])[
+            y_hat = predictive(g, features, mask=g.ndata["test_mask"])[
                 "_RETURN"
             ].mean(0)
-            y = g.ndata["label"][g.ndata["test_mask"]]
-            accuracy_te = float((y_hat.argmax(-1) == y.argmax(-1)).sum()) / len(
+            y = get_labels(g.ndata["label"][g.ndata["test_mask"]])
+            accuracy_te = float((y_hat.argmax(-1) == y).sum()) / len(
                 y_hat
             )
-        
-        # print(accuracy_vl, accuracy_te, flush=True)
-        if next(iter(scheduler.get_state().values()))["optimizer"]["param_groups"][0]["lr"] < 1e-6:
-            break
-        scheduler.step(accuracy_vl)
-
-        if accuracy_vl > accuracy_vl_max:
-            accuracy_vl_max = accuracy_vl
-            accuracy_te_max = accuracy_te
-            if args.checkpoint != "":
-                print(args.checkpoint, flush=True)
-                torch.save(model, args.checkpoint)
-
-    accuracy_vl = accuracy_vl_max
-    accuracy_te = accuracy_te_max
+        return {"accuracy_epoch": accuracy_vl, "accuracy_te_epoch": accuracy_te}
+
+    def save_checkpoint(trainer, metrics):
+        if metrics.get("improved") and args.checkpoint != "":
+            print(args.checkpoint, flush=True)
+            torch.save(model, args.checkpoint)
+
+    trainer = Trainer(
+        step,
+        evaluate=evaluate,
+        scheduler=scheduler,
+        metric="accuracy_epoch",
+        mode="max",
+        eval_every=getattr(args, "eval_every", 1),
+        eval_time=getattr(args, "eval_time", 0.0),
+        min_lr=1e-6,
+        hooks=[save_checkpoint],
+        model=model,
+    )
+
+    epoch = 0
+    accuracy_vl_max, accuracy_te_max = 0.0, 0.0
+    if state is not None:
+        learning_rate = state.get("learning_rate")
+        epoch = load_state(
+            state, model, scheduler, 
+            args.learning_rate if learning_rate != args.learning_rate else None,
+        )
+        accuracy_vl_max, accuracy_te_max = state["accuracy"], state["accuracy_te"]
+        trainer.best = accuracy_vl_max
+
+    accuracy_vl = 0.0
+    with Telemetry(getattr(args, "telemetry", ""), data=args.data) as telemetry:
+        for metrics in trainer.run(args.n_epochs, start_epoch=epoch):
+            if "accuracy_epoch" in metrics:
+                accuracy_vl = metrics["accuracy_epoch"]
+                if metrics["improved"]:
+                    accuracy_vl_max = accuracy_vl
+                    accuracy_te_max = metrics["accuracy_te_epoch"]
+
+            # timings, NFE and memory are reported along with the accuracies
+            metrics.pop("improved", None)
+            metrics.pop("accuracy_te_epoch", None)
+            metrics.update(
+                accuracy=accuracy_vl_max,
+                accuracy_te=accuracy_te_max,
+                accuracy_epoch=accuracy_vl,
+            )
+
+            def get_state(epoch=metrics["epoch"]+1, metrics=metrics):
+                return {
+                    "model": model.state_dict(),
+                    "scheduler": scheduler.get_state(),
+                    "epoch": epoch,
+                    "learning_rate": args.learning_rate,
+                    "accuracy": metrics["accuracy"],
+                    "accuracy_te": metrics["accuracy_te"],
+                }
+
+            try:
+                yield metrics, get_state
+            finally:
+                # after the consumer added e.g. the checkpoint time, and also
+                # when it abandons training (a trial stopped by the scheduler)
+                telemetry(metrics)
+
+def train_with_checkpoints(args):
+    # continue from the trial's checkpoint (e.g. after a hyperband pause or
+    # a population-based-training exploit) and checkpoint periodically
+    from ray.air import Checkpoint
+    checkpoint = session.get_checkpoint()
+    state = checkpoint.to_dict() if checkpoint is not None else None
+    freq = getattr(args, "checkpoint_freq", 0)
+    for metrics, get_state in train(args, state=state):
+        if freq > 0 and (metrics["epoch"] + 1) % freq == 0:
+            time0 = time.time()
+            checkpoint = Checkpoint.from_dict(get_state())
+            metrics["time_checkpoint"] = time.time() - time0
+            session.report(metrics, checkpoint=checkpoint)
+        else:
+            session.report(metrics)
+        yield metrics
+
+def load_state(state, model, scheduler, learning_rate=None):
+    """Restore a training state written by ``train``.
+
+    All parameters live in the model, so its state dict also restores the
+    pyro param store once it is repopulated; the optimizer and LR
+    scheduler states are consumed lazily by pyro when the optimizers are
+    created at the first step. If ``learning_rate`` is given, it replaces
+    the stored one (e.g. after a population-based-training mutation).
+    """
+    model.load_state_dict(state["model"])
+    scheduler_state = state["scheduler"]
+    if learning_rate is not None:
+        for value in scheduler_state.values():
+            for group in value["optimizer"]["param_groups"]:
+                group["lr"] = learning_rate
+    scheduler.set_state(scheduler_state)
+    return state["epoch"]
+
+def run(args):
+    state = None
+    if getattr(args, "resume", ""):
+        state = torch.load(args.resume, map_location="cpu")
+
+    accuracy_vl, accuracy_te = 0.0, 0.0
+    get_state = None
+    for metrics, get_state in train(args, state=state):
+        accuracy_vl, accuracy_te = metrics["accuracy"], metrics["accuracy_te"]
+
+    if getattr(args, "save_state", "") and get_state is not None:
+        torch.save(get_state(), args.save_state)
     print("ACCURACY,%.6f,%.6f" % (accuracy_vl, accuracy_te), flush=True)
     return accuracy_vl, accuracy_te
 
@@ -188,6 +367,7 @@ if __name__ == "__main__":
     parser.add_argument("--depth", type=int, default=1)
     parser.add_argument("--num_samples", type=int, default=4)
     parser.add_argument("--num_particles", type=int, default=4)
+    parser.add_argument("--particle_chunk_size", type=int, default=0)
     parser.add_argument("--num_heads", type=int, default=4)
     parser.add_argument("--sigma_factor", type=float, default=5.0)
     parser.add_argument("--t", type=float, default=5.0)
@@ -198,6 +378,14 @@ if __name__ == "__main__":
     parser.add_argument("--physique", type=int, default=1)
     parser.add_argument("--gamma", type=float, default=1.0)
     parser.add_argument("--readout_depth", type=int, default=1)
+    parser.add_argument(
+        "--fused", type=int, default=0,
+        help="solve all layers at once; for depth > 1 every layer's edge "
+        "posterior is computed from the input features, which changes the model; "
+        "requires --physique 0",
+    )
+    parser.add_argument("--multilevel", type=int, default=0)
+    parser.add_argument("--fine_fraction", type=float, default=0.1)
     parser.add_argument("--dropout_in", type=float, default=0.5)
     parser.add_argument("--dropout_out", type=float, default=0.5)
     parser.add_argument("--consistency_temperature", type=float, default=0.1)
@@ -206,11 +394,31 @@ if __name__ == "__main__":
     parser.add_argument("--norm", type=int, default=1)
     parser.add_argument("--k", type=int, default=0)
     parser.add_argument("--checkpoint", type=str, default="")
+    parser.add_argument("--resume", type=str, default="")
+    parser.add_argument("--save_state", type=str, default="")
+    parser.add_argument("--checkpoint_freq", type=int, default=0)
+    parser.add_argument("--eval_every", type=int, default=1)
+    parser.add_argument("--eval_time", type=float, default=0.0)
+    parser.add_argument("--telemetry", type=str, default="")
     parser.add_argument("--seed", type=int, default=-1)
     parser.add_argument("--patience", type=int, default=10)
     parser.add_argument("--split_index", type=int, default=-1)
     parser.add_argument("--edge_recover", default=0.0, type=float)
+    parser.add_argument("--edge_recover_negatives", default=1, type=int)
     parser.add_argument("--lr_factor", default=0.5, type=float)
+    parser.add_argument("--one_hot", default=0, type=int)
+    parser.add_argument(
+        "--mmap_features", default="", type=str,
+        help="path of a .npy file to memory-map the node features from, "
+        "written on first use and tagged with the dataset and --k; the "
+        "dataset itself is still loaded into memory by dgl",
+    )
+    parser.add_argument("--chunk_size", default=0, type=int)
+    parser.add_argument("--hidden_cache", default="", type=str)
     parser.add_argument("--__trial_index__", default=0, type=int)
     args = parser.parse_args()
+    if args.fused and args.multilevel > 0:
+        raise ValueError("--fused does not support --multilevel.")
+    if args.fused and args.physique:
+        raise ValueError("--fused does not support --physique.")
     run(args)
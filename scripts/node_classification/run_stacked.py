@@ -0,0 +1,188 @@
+import re
+import json
+import math
+import time
+import torch
+import pyro
+import dgl
+dgl.use_libxsmm(False)
+from bronx.models import StackedNodeClassificationBronxModel
+from bronx.infer import get_elbo
+from bronx.train import Trainer
+from run import get_graph_cached, get_labels, get_num_classes
+
+def run_stacked(args, configs):
+    """Train ``len(configs)`` configurations sharing ``args`` in one
+    vectorized model and return the best validation / test accuracy of
+    each of them."""
+    if getattr(args, "edge_recover", 0.0) > 0:
+        raise ValueError("The stacked model does not support --edge_recover.")
+    pyro.clear_param_store()
+    if args.seed > 0:
+        torch.manual_seed(args.seed)
+
+    g = get_graph_cached(args.data).local_var()
+    num_stacks = len(configs)
+
+    model = StackedNodeClassificationBronxModel(
+        num_stacks=num_stacks,
+        in_features=g.ndata["feat"].shape[-1],
+        out_features=get_num_classes(g.ndata["label"]),
+        hidden_features=args.hidden_features,
+        embedding_features=args.embedding_features,
+        depth=args.depth,
+        num_heads=args.num_heads,
+        sigma_factor=[config["sigma_factor"] for config in configs],
+        kl_scale=[config["kl_scale"] for config in configs],
+        t=args.t,
+        adjoint=bool(args.adjoint),
+        activation=getattr(torch.nn, args.activation)(),
+        physique=args.physique,
+        gamma=args.gamma,
+        dropout_in=args.dropout_in,
+        dropout_out=args.dropout_out,
+        consistency_temperature=args.consistency_temperature,
+        consistency_factor=args.consistency_factor,
+        norm=bool(args.norm),
+        node_prior=bool(args.node_prior),
+    )
+
+    if torch.cuda.is_available():
+        model = model.cuda()
+        g = g.to("cuda:0")
+
+    def optim_args(module_name, param_name):
+        match = re.search(r"_(\d+)$", param_name)
+        config = configs[int(match.group(1))] if match else configs[0]
+        return {
+            "lr": config["learning_rate"],
+            "weight_decay": config["weight_decay"],
+        }
+
+    svi = pyro.infer.SVI(
+        model,
+        model.guide,
+        getattr(pyro.optim, args.optimizer)(optim_args),
+        loss=get_elbo(args.num_particles, args.particle_chunk_size),
+    )
+
+    y = get_labels(g.ndata["label"])
+    accuracy_vl_max = torch.zeros(num_stacks)
+    accuracy_te_max = torch.zeros(num_stacks)
+
+    def step(epoch):
+        model.train()
+        return svi.step(g, g.ndata["feat"], y=y, mask=g.ndata["train_mask"])
+
+    def evaluate():
+        # the best epoch of every configuration on its own
+        nonlocal accuracy_vl_max, accuracy_te_max
+        model.eval()
+        with torch.no_grad():
+            predictive = pyro.infer.Predictive(
+                model,
+                guide=model.guide,
+                num_samples=args.num_samples,
+                parallel=True,
+                return_sites=["_RETURN"],
+            )
+            y_hat = predictive(g, g.ndata["feat"])["_RETURN"].mean(0)
+            correct = (y_hat.argmax(-1) == y).float().cpu()
+            accuracy_vl = correct[:, g.ndata["val_mask"].cpu()].mean(-1)
+            accuracy_te = correct[:, g.ndata["test_mask"].cpu()].mean(-1)
+
+        improved = accuracy_vl > accuracy_vl_max
+        accuracy_vl_max = torch.where(improved, accuracy_vl, accuracy_vl_max)
+        accuracy_te_max = torch.where(improved, accuracy_te, accuracy_te_max)
+        return {"accuracy": float(accuracy_vl_max.mean())}
+
+    trainer = Trainer(
+        step,
+        evaluate=evaluate,
+        metric="accuracy",
+        mode="max",
+        eval_every=getattr(args, "eval_every", 1),
+        eval_time=getattr(args, "eval_time", 0.0),
+    )
+    time0 = time.time()
+    for metrics in trainer.run(args.n_epochs):
+        pass
+
+    duration = time.time() - time0
+    return [
+        {
+            "config": config,
+            "accuracy": float(accuracy_vl_max[idx]),
+            "accuracy_te": float(accuracy_te_max[idx]),
+            "time_per_config": duration / num_stacks,
+        }
+        for idx, config in enumerate(configs)
+    ]
+
+def sample_configs(num_stacks):
+    def loguniform(low, high):
+        return math.exp(
+            math.log(low) + float(torch.rand(())) * (math.log(high) - math.log(low))
+        )
+
+    def uniform(low, high):
+        return low + float(torch.rand(())) * (high - low)
+
+    return [
+        {
+            "learning_rate": loguniform(1e-5, 1e-2),
+            "weight_decay": loguniform(1e-10, 1e-2),
+            "kl_scale": loguniform(1e-5, 1e-2),
+            "sigma_factor": uniform(1.0, 15.0),
+        }
+        for _ in range(num_stacks)
+    ]
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, default="CoraGraphDataset")
+    parser.add_argument("--configs", type=str, default="")
+    parser.add_argument("--num_stacks", type=int, default=16)
+    parser.add_argument("--hidden_features", type=int, default=32)
+    parser.add_argument("--embedding_features", type=int, default=32)
+    parser.add_argument("--activation", type=str, default="ELU")
+    parser.add_argument("--depth", type=int, default=1)
+    parser.add_argument("--num_samples", type=int, default=4)
+    parser.add_argument("--num_particles", type=int, default=4)
+    parser.add_argument("--particle_chunk_size", type=int, default=0)
+    parser.add_argument("--num_heads", type=int, default=4)
+    parser.add_argument("--t", type=float, default=5.0)
+    parser.add_argument("--optimizer", type=str, default="Adam")
+    parser.add_argument("--n_epochs", type=int, default=100)
+    parser.add_argument("--adjoint", type=int, default=1)
+    parser.add_argument("--physique", type=int, default=1)
+    parser.add_argument("--gamma", type=float, default=1.0)
+    parser.add_argument("--dropout_in", type=float, default=0.5)
+    parser.add_argument("--dropout_out", type=float, default=0.5)
+    parser.add_argument("--consistency_temperature", type=float, default=0.1)
+    parser.add_argument("--consistency_factor", type=float, default=1e-5)
+    parser.add_argument("--norm", type=int, default=1)
+    parser.add_argument("--node_prior", type=int, default=1)
+    parser.add_argument(
+        "--edge_recover", type=float, default=0.0,
+        help="not supported by the stacked model, which rejects values > 0",
+    )
+    parser.add_argument("--eval_every", type=int, default=1)
+    parser.add_argument("--eval_time", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=-1)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+
+    if args.configs != "":
+        with open(args.configs, "r") as f:
+            configs = json.load(f)
+    else:
+        configs = sample_configs(args.num_stacks)
+
+    results = run_stacked(args, configs)
+    for result in results:
+        print(json.dumps(result), flush=True)
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
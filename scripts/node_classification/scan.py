@@ -1,12 +1,19 @@
-import ray
-from ray.tune import ExperimentAnalysis
+import pandas as pd
+from results import get_index
 
-def run(path):
-    analysis = ExperimentAnalysis(path)
-    df = analysis.dataframe()
-    df.sort_values("_metric/accuracy", ascending=False, inplace=True)
+def run(args):
+    results = get_index(args).top(metric=args.metric)
+    df = pd.DataFrame(
+        [{**result["config"], **result["_metric"]} for result in results]
+    )
     print(df)
 
 if __name__ == "__main__":
-    import sys
-    run(sys.argv[1])
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", type=str, default=".")
+    parser.add_argument("--index", type=str, default="")
+    parser.add_argument("--collect", type=int, default=0)
+    parser.add_argument("--metric", type=str, default="accuracy")
+    args = parser.parse_args()
+    run(args)
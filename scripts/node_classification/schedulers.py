@@ -0,0 +1,37 @@
+from ray import tune
+
+def get_scheduler(name, max_t=100, grace_period=10):
+    from ray.tune.schedulers import (
+        ASHAScheduler, 
+        MedianStoppingRule,
+        HyperBandScheduler,
+        PopulationBasedTraining,
+    )
+    if name == "hyperband":
+        return HyperBandScheduler(
+            time_attr="training_iteration",
+            max_t=max_t,
+            reduction_factor=3,
+        )
+    if name == "pbt":
+        return PopulationBasedTraining(
+            time_attr="training_iteration",
+            perturbation_interval=grace_period,
+            hyperparam_mutations={
+                "learning_rate": tune.loguniform(1e-5, 1e-2),
+                "kl_scale": tune.loguniform(1e-5, 1e-2),
+            },
+        )
+    if name == "asha":
+        return ASHAScheduler(
+            time_attr="training_iteration",
+            max_t=max_t,
+            grace_period=grace_period,
+            reduction_factor=3,
+        )
+    if name == "median":
+        return MedianStoppingRule(
+            time_attr="training_iteration",
+            grace_period=grace_period,
+        )
+    return None
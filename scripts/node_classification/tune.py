@@ -1,8 +1,10 @@
 from types import SimpleNamespace
 from datetime import datetime
-from run import run
+from run import train_with_checkpoints
+from schedulers import get_scheduler
+from results import ResultsIndex, add_trial, index_path
 import ray
-from ray import tune, air, train
+from ray import tune, air
 from ray.tune.trainable import session
 from ray.tune.search.optuna import OptunaSearch
 import os
@@ -22,10 +24,12 @@ def multiply_by_heads(args):
     return args
 
 def objective(args):
+    index = ResultsIndex(args.pop("index"))
     args = multiply_by_heads(args)
+    config = dict(args)
     args = SimpleNamespace(**args)
-    accuracy_vl, accuracy_te = run(args)
-    session.report({"accuracy": accuracy_vl, "accuracy_te": accuracy_te})
+    for metrics in train_with_checkpoints(args):
+        add_trial(index, config, metrics)
 
 def experiment(args):
     name = datetime.now().strftime("%m%d%Y%H%M%S")
@@ -61,13 +65,17 @@ def experiment(args):
         "split_index": -1,
         "patience": 10,
         "lr_factor": 0.5,
+        "checkpoint_freq": args.checkpoint_freq,
+        "index": index_path(args),
     }
 
     tune_config = tune.TuneConfig(
         metric="_metric/accuracy",
         mode="max",
         search_alg=OptunaSearch(),
+        scheduler=get_scheduler(args.scheduler, grace_period=args.grace_period),
         num_samples=10000,
+        reuse_actors=True,
     )
 
     run_config = air.RunConfig(
@@ -89,5 +97,12 @@ if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--data", type=str, default="CoraGraphDataset")
+    parser.add_argument("--scheduler", type=str, default="asha", choices=["none", "asha", "median", "hyperband", "pbt"])
+    parser.add_argument("--grace_period", type=int, default=10)
+    parser.add_argument("--checkpoint_freq", type=int, default=10)
+    parser.add_argument(
+        "--index", type=str, default="",
+        help="results index, by default the one the check scripts read",
+    )
     args = parser.parse_args()
     experiment(args)
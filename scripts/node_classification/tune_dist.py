@@ -1,9 +1,11 @@
 from calendar import c
 from types import SimpleNamespace
 from datetime import datetime
-from run import run
+from run import train_with_checkpoints
+from schedulers import get_scheduler
+from results import ResultsIndex, add_trial, index_path
 import ray
-from ray import tune, air, train
+from ray import tune, air
 from ray.tune.trainable import session
 from ray.tune.search import ConcurrencyLimiter, Repeater
 from ray.tune.search.hyperopt import HyperOptSearch
@@ -48,13 +50,22 @@ def multiply_by_heads(args):
     return args
 
 def objective(args):
+    executor = args.pop("executor", "lsf")
+    index = ResultsIndex(args.pop("index"))
     args = multiply_by_heads(args)
     checkpoint = os.path.join(os.getcwd(), "model.pt")
     args["checkpoint"] = checkpoint
+    if executor == "local":
+        # run in this (reused) local worker process and report every epoch
+        for metrics in train_with_checkpoints(SimpleNamespace(**args)):
+            add_trial(index, args, metrics)
+        return
     command = args_to_command(args)
     output = lsf_submit(command)
     accuracy, accuracy_te = parse_output(output)
-    session.report({"accuracy": accuracy, "accuracy_te": accuracy_te})
+    metrics = {"accuracy": accuracy, "accuracy_te": accuracy_te}
+    session.report(metrics)
+    add_trial(index, args, metrics)
     # return accuracy
 
 def experiment(args):
@@ -88,6 +99,12 @@ def experiment(args):
         "edge_recover": 0.0, # tune.loguniform(1e-5, 1e-1),
         "seed": 2666,
         "k": 0,
+        "split_index": -1,
+        "patience": 10,
+        "lr_factor": 0.5,
+        "checkpoint_freq": args.checkpoint_freq,
+        "executor": args.executor,
+        "index": index_path(args),
     }
 
     tune_config = tune.TuneConfig(
@@ -97,7 +114,10 @@ def experiment(args):
             Repeater(HyperOptSearch(), repeat=3),
             args.concurrent
         ),
+        scheduler=get_scheduler(args.scheduler, grace_period=args.grace_period)
+        if args.executor == "local" else None,
         num_samples=3000,
+        reuse_actors=True,
     )
 
     run_config = air.RunConfig(
@@ -106,7 +126,9 @@ def experiment(args):
     )
 
     tuner = tune.Tuner(
-        tune.with_resources(objective, {"cpu": 0.01}),
+        tune.with_resources(
+            objective, {"cpu": 1 if args.executor == "local" else 0.01},
+        ),
         param_space=param_space,
         tune_config=tune_config,
         run_config=run_config,
@@ -119,5 +141,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--data", type=str, default="CoraGraphDataset")
     parser.add_argument("--concurrent", type=int, default=100)
+    parser.add_argument("--executor", type=str, default="lsf", choices=["lsf", "local"])
+    parser.add_argument("--scheduler", type=str, default="asha", choices=["none", "asha", "median", "hyperband", "pbt"])
+    parser.add_argument("--grace_period", type=int, default=10)
+    parser.add_argument("--checkpoint_freq", type=int, default=10)
+    parser.add_argument(
+        "--index", type=str, default="",
+        help="results index, by default the one the check scripts read",
+    )
     args = parser.parse_args()
     experiment(args)
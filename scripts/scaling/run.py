@@ -0,0 +1,185 @@
+import time
+import json
+import torch
+import pyro
+import dgl
+dgl.use_libxsmm(False)
+from bronx.models import NodeClassificationBronxModel, GraphRegressionBronxModel
+from bronx.synthetic import node_classification_graph, molecule_batch
+from bronx.infer import get_elbo
+from bronx.profiling import profile_memory, peak_memory
+from bronx.utils import prepare_graph
+
+def measure(args, model, svi, predictive, inputs, kwargs):
+    time0 = time.time()
+    for _ in range(args.warmup):
+        svi.step(*inputs, **kwargs)
+    time_setup = time.time() - time0
+
+    model.reset_nfe()
+    time0 = time.time()
+    for _ in range(args.n_steps):
+        svi.step(*inputs, **kwargs)
+    time_step = (time.time() - time0) / args.n_steps
+    nfe_step = model.nfe / args.n_steps
+
+    model.eval()
+    model.reset_nfe()
+    time0 = time.time()
+    with torch.no_grad():
+        predictive(*inputs)
+    time_predict = time.time() - time0
+
+    result = {
+        "time_setup": time_setup,
+        "time_step": time_step,
+        "time_predict": time_predict,
+        "nfe_step": nfe_step,
+        "nfe_predict": model.nfe,
+    }
+
+    if args.profile_memory:
+        # per-component breakdown of one more step and prediction
+        model.train()
+        _, result["memory_step"] = profile_memory(svi.step, *inputs, **kwargs)
+        model.eval()
+        with torch.no_grad():
+            _, result["memory_predict"] = profile_memory(predictive, *inputs)
+    return result
+
+def get_predictive(args, model):
+    return pyro.infer.Predictive(
+        model,
+        guide=model.guide,
+        num_samples=args.num_samples,
+        parallel=True,
+        return_sites=["_RETURN"],
+    )
+
+def node_classification(args, size):
+    time0 = time.time()
+    g = node_classification_graph(
+        size,
+        avg_degree=args.avg_degree,
+        num_classes=args.num_classes,
+        num_features=args.num_features,
+        exponent=args.exponent,
+        seed=args.seed,
+    )
+    time_generate = time.time() - time0
+    model = NodeClassificationBronxModel(
+        in_features=args.num_features,
+        hidden_features=args.hidden_features,
+        out_features=args.num_classes,
+        num_heads=args.num_heads,
+        t=args.t,
+        adjoint=bool(args.adjoint),
+        physique=bool(args.physique),
+    )
+    if torch.cuda.is_available():
+        model, g = model.cuda(), g.to("cuda:0")
+    g = prepare_graph(g, reverse=False)
+    svi = pyro.infer.SVI(
+        model, model.guide, pyro.optim.Adam({"lr": 1e-3}),
+        loss=get_elbo(args.num_particles, args.particle_chunk_size),
+    )
+    result = measure(
+        args, model, svi, get_predictive(args, model),
+        (g, g.ndata["feat"]),
+        {"y": g.ndata["label"], "mask": g.ndata["train_mask"]},
+    )
+    result["time_generate"] = time_generate
+    result["num_nodes"] = g.number_of_nodes()
+    result["num_edges"] = g.number_of_edges()
+    result["edges_per_second"] = g.number_of_edges() / result["time_step"]
+    return result
+
+def graph_regression(args, size):
+    time0 = time.time()
+    g, y = molecule_batch(size, num_features=args.num_features, seed=args.seed)
+    time_generate = time.time() - time0
+    model = GraphRegressionBronxModel(
+        in_features=args.num_features,
+        hidden_features=args.hidden_features,
+        out_features=1,
+        num_heads=args.num_heads,
+        t=args.t,
+        adjoint=bool(args.adjoint),
+        physique=bool(args.physique),
+        y_mean=y.mean(),
+        y_std=y.std(),
+    )
+    if torch.cuda.is_available():
+        model, g, y = model.cuda(), g.to("cuda:0"), y.cuda()
+    g = prepare_graph(g, reverse=False)
+    svi = pyro.infer.SVI(
+        model, model.guide, pyro.optim.Adam({"lr": 1e-3}),
+        loss=get_elbo(args.num_particles, args.particle_chunk_size),
+    )
+    result = measure(
+        args, model, svi, get_predictive(args, model),
+        (g, g.ndata["h0"]), {"y": y},
+    )
+    result["time_generate"] = time_generate
+    result["num_graphs"] = g.batch_size
+    result["num_nodes"] = g.number_of_nodes()
+    result["num_edges"] = g.number_of_edges()
+    result["graphs_per_second"] = g.batch_size / result["time_step"]
+    return result
+
+def worker(args, size):
+    torch.manual_seed(args.seed)
+    pyro.clear_param_store()
+    fn = node_classification if args.task == "node_classification" else graph_regression
+    result = fn(args, size)
+    result["task"] = args.task
+    result["size"] = size
+    result["peak_memory"] = peak_memory()
+    return result
+
+def run(args):
+    # every size runs in a fresh process so that the peak memory is its own
+    from concurrent.futures import ProcessPoolExecutor
+    context = torch.multiprocessing.get_context("spawn")
+    report = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            try:
+                result = executor.submit(worker, args, size).result()
+            except Exception as error:
+                # e.g. killed for running out of memory
+                result = {"task": args.task, "size": size, "error": repr(error)}
+        print(json.dumps(result), flush=True)
+        report.append(result)
+    return report
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--task", type=str, default="node_classification",
+        choices=["node_classification", "graph_regression"],
+    )
+    parser.add_argument("--sizes", type=str, default="10000,100000,1000000")
+    parser.add_argument("--avg_degree", type=float, default=10)
+    parser.add_argument("--exponent", type=float, default=2.5)
+    parser.add_argument("--num_classes", type=int, default=4)
+    parser.add_argument("--num_features", type=int, default=32)
+    parser.add_argument("--hidden_features", type=int, default=32)
+    parser.add_argument("--num_heads", type=int, default=4)
+    parser.add_argument("--num_particles", type=int, default=4)
+    parser.add_argument("--particle_chunk_size", type=int, default=0)
+    parser.add_argument("--num_samples", type=int, default=4)
+    parser.add_argument("--t", type=float, default=1.0)
+    parser.add_argument("--adjoint", type=int, default=1)
+    parser.add_argument("--physique", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--n_steps", type=int, default=3)
+    parser.add_argument("--profile_memory", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=2666)
+    parser.add_argument("--output", type=str, default="")
+    args = parser.parse_args()
+    report = run(args)
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)